@@ -2,7 +2,10 @@ import pyterrier as pt
 from pathlib import Path
 from fast_forward.encoder import TCTColBERTQueryEncoder, TCTColBERTDocumentEncoder
 import torch
-from fast_forward import OnDiskIndex, Mode, Indexer
+from functools import partial
+from fast_forward import Mode
+from util.disk import OnDiskIndex
+from util.ParallelIndexer import ParallelIndexer, TCTColBERTTokenLengths
 
 
 def docs_iter(dataset):
@@ -25,17 +28,31 @@ def main():
     dataset = pt.get_dataset("irds:beir/arguana")
 
     q_encoder = TCTColBERTQueryEncoder("castorini/tct_colbert-msmarco")
-    d_encoder = TCTColBERTDocumentEncoder(
+    d_encoder = partial(
+        TCTColBERTDocumentEncoder,
         "castorini/tct_colbert-msmarco",
         device="cuda:0" if torch.cuda.is_available() else "cpu",
     )
 
-    ff_index = OnDiskIndex(
-        Path("ffindex_arguana_tct.h5"), dim=768, query_encoder=q_encoder, mode=Mode.MAXP, max_id_length=53
+    index_file = Path("ffindex_arguana_tct.h5")
+    # an existing index is resumed from its watermark
+    if index_file.exists():
+        ff_index = OnDiskIndex.load(index_file, query_encoder=q_encoder, mode=Mode.MAXP)
+    else:
+        ff_index = OnDiskIndex(
+            index_file, dim=768, query_encoder=q_encoder, mode=Mode.MAXP
+        )
+
+    # a single encoder process on the GPU, one per CPU core otherwise
+    ff_indexer = ParallelIndexer(
+        ff_index,
+        d_encoder,
+        batch_size=128,
+        num_workers=1 if torch.cuda.is_available() else None,
+        length_fn=TCTColBERTTokenLengths("castorini/tct_colbert-msmarco"),
     )
-
-    ff_indexer = Indexer(ff_index, d_encoder, batch_size=128)
     ff_indexer.index_dicts(docs_iter(dataset))
+    ff_index.close()
 
 if __name__ == '__main__':
     main()
@@ -3,29 +3,23 @@ from pathlib import Path
 import pandas as pd
 from fast_forward import Mode
 from fast_forward.encoder import TCTColBERTQueryEncoder
-from fast_forward.util.pyterrier import FFScore, FFInterpolate
+from fast_forward.util.pyterrier import FFInterpolate
 
 from util.disk import OnDiskIndex
 from util.CondorcetFuseInterpolate import CondorcetFuseInterpolate
+from util.DocnoDictionary import DocnoDictionary
 from util.EncodeTransformer import EncodeTransformer
 from util.FFMinMaxInterpolate import FFMinMaxInterpolate
 from util.FFZScoreInterpolate import FFZScoreInterpolate
 from util.InverseSquareRankInterpolate import InverseSquareRankInterpolate
 from util.CombMNZInterpolate import CombMNZInterpolate
+from util.MultiFusion import MultiFusion
+from util.FFBatchScore import FFBatchScore
 
 from pyterrier.measures import RR, nDCG, MAP
 
 from util.ReciprocalInterpolate import ReciprocalInterpolate
 
-def transform_index(dataset):
-    """
-    Encode docno
-    :param dataset: dataset to be encoded
-    :return: dataset with encoded docno
-    """
-    for d in dataset.get_corpus_iter():
-        d['docno'] = str(d['docno'].encode('utf-8'))
-        yield d
 def main():
     """
     Running ranking effectiveness experiment on DBPedia
@@ -34,31 +28,34 @@ def main():
         pt.init()
 
     dataset = pt.get_dataset('irds:beir/dbpedia-entity/test')
-    max_doc_len = 206
 
+    # the docnos are replaced by their codes in the indexes, they are restored for evaluation
+    docnos = DocnoDictionary()
     indexer = pt.IterDictIndexer(
         str(Path.cwd()),  # this will be ignored
         type=pt.index.IndexingType.MEMORY,
-        meta={'docno': max_doc_len}
+        meta={'docno': DocnoDictionary.code_length}
     )
 
-    index_ref = indexer.index(transform_index(dataset), fields=['text', 'title', 'url'])
+    index_ref = indexer.index(docnos.encode_corpus(dataset.get_corpus_iter()), fields=['text', 'title', 'url'])
     bm25 = pt.BatchRetrieve(index_ref, wmodel="BM25")
 
     index_path = "ffindex_dbpedia_entity_tct.h5"
     q_encoder = TCTColBERTQueryEncoder("castorini/tct_colbert-msmarco")
+    docnos.check_fingerprint(Path(index_path))
 
     ff_index = OnDiskIndex.load(
         Path(index_path), query_encoder=q_encoder, mode=Mode.MAXP
     )
 
     ff_index = ff_index.to_memory()
-    ff_score = FFScore(ff_index)
+    ff_score = FFBatchScore(ff_index)
     num_candidates = 100
     sparse = (~bm25 % num_candidates)(dataset.get_topics())
-    encoding = EncodeTransformer()
+    candidates = ff_score(sparse)
+    encoding = EncodeTransformer(docnos)
     encoded = encoding(sparse)
-    candidates = ff_score(encoded)
+    candidates = encoding(candidates)
 
     convex = FFInterpolate(alpha=0.1)
     convex_mm = FFMinMaxInterpolate(alpha=0.4)
@@ -68,15 +65,10 @@ def main():
     isr = InverseSquareRankInterpolate()
     combMNZ = CombMNZInterpolate(num_candidates)
 
+    fusion = MultiFusion([convex, convex_mm, convex_z, reciprocal, condorcet, isr, combMNZ])
+
     experiment = pt.Experiment(
-            [encoded,
-             candidates >> convex,
-             candidates >> convex_mm,
-             candidates >> convex_z,
-             candidates >> reciprocal,
-             candidates >> condorcet,
-             candidates >> isr,
-             candidates >> combMNZ],
+            [encoded] + fusion.runs(candidates),
             dataset.get_topics(),
             dataset.get_qrels(),
             eval_metrics=[RR @ 10, nDCG @ 10, MAP @ 100],
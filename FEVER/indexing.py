@@ -2,18 +2,23 @@ import pyterrier as pt
 from pathlib import Path
 from fast_forward.encoder import TCTColBERTQueryEncoder, TCTColBERTDocumentEncoder
 import torch
-from fast_forward import Mode, Indexer
+from functools import partial
+from fast_forward import Mode
 from util.disk import OnDiskIndex
+from util.DocnoDictionary import DocnoDictionary
+from util.ParallelIndexer import ParallelIndexer, TCTColBERTTokenLengths
 
 
-def docs_iter(dataset):
+def docs_iter(dataset, docnos):
     """
             Save the corpus data as a dictionary
             :param dataset: dataset to index
+            :param docnos: DocnoDictionary to encode the docnos with
             :return: Dictionary of documents in the corpus
     """
-    for d in dataset.get_corpus_iter():
-        yield {"doc_id": d["docno"].encode(), "text": d["text"], "title": d["title"]}
+    # the codes of the docnos are the IDs, like in the sparse index of the experiments
+    for d in docnos.encode_corpus(dataset.get_corpus_iter()):
+        yield {"doc_id": d["docno"], "text": d["text"], "title": d["title"]}
 
 
 def main():
@@ -26,17 +31,34 @@ def main():
     dataset = pt.get_dataset("irds:beir/fever")
 
     q_encoder = TCTColBERTQueryEncoder("castorini/tct_colbert-msmarco")
-    d_encoder = TCTColBERTDocumentEncoder(
+    d_encoder = partial(
+        TCTColBERTDocumentEncoder,
         "castorini/tct_colbert-msmarco",
         device="cuda:0" if torch.cuda.is_available() else "cpu",
     )
 
-    ff_index = OnDiskIndex(
-        Path("ffindex_fever_tct.h5"), dim=768, query_encoder=q_encoder, mode=Mode.MAXP, max_id_length=221
-    )
+    index_file = Path("ffindex_fever_tct.h5")
+    # an existing index is resumed from its watermark
+    if index_file.exists():
+        ff_index = OnDiskIndex.load(index_file, query_encoder=q_encoder, mode=Mode.MAXP)
+    else:
+        ff_index = OnDiskIndex(
+            index_file, dim=768, query_encoder=q_encoder, mode=Mode.MAXP
+        )
 
-    ff_indexer = Indexer(ff_index, d_encoder, batch_size=8)
-    ff_indexer.index_dicts(docs_iter(dataset))
+    # a single encoder process on the GPU, one per CPU core otherwise
+    ff_indexer = ParallelIndexer(
+        ff_index,
+        d_encoder,
+        batch_size=8,
+        num_workers=1 if torch.cuda.is_available() else None,
+        length_fn=TCTColBERTTokenLengths("castorini/tct_colbert-msmarco"),
+    )
+    docnos = DocnoDictionary()
+    ff_indexer.index_dicts(docs_iter(dataset, docnos))
+    ff_index.close()
+    # the experiments check that their codes were assigned in the same corpus order
+    docnos.save_fingerprint(index_file)
 
 if __name__ == '__main__':
     main()
@@ -1,15 +1,18 @@
 import pyterrier as pt
 from pathlib import Path
 import pandas as pd
-from fast_forward import OnDiskIndex, Mode
+from fast_forward import Mode
 from fast_forward.encoder import TCTColBERTQueryEncoder
-from fast_forward.util.pyterrier import FFScore, FFInterpolate
+from fast_forward.util.pyterrier import FFInterpolate
 
+from util.disk import OnDiskIndex
 from util.CondorcetFuseInterpolate import CondorcetFuseInterpolate
 from util.FFMinMaxInterpolate import FFMinMaxInterpolate
 from util.FFZScoreInterpolate import FFZScoreInterpolate
 from util.InverseSquareRankInterpolate import InverseSquareRankInterpolate
 from util.CombMNZInterpolate import CombMNZInterpolate
+from util.MultiFusion import MultiFusion
+from util.FFBatchScore import FFBatchScore
 
 from pyterrier.measures import RR, nDCG, MAP
 
@@ -43,7 +46,7 @@ def main():
     )
 
     ff_index = ff_index.to_memory()
-    ff_score = FFScore(ff_index)
+    ff_score = FFBatchScore(ff_index)
     num_candidates = 100
     sparse = (~bm25 % num_candidates)(dataset.get_topics())
     candidates = ff_score(sparse)
@@ -56,15 +59,10 @@ def main():
     isr = InverseSquareRankInterpolate()
     combMNZ = CombMNZInterpolate(num_candidates)
 
+    fusion = MultiFusion([convex, convex_mm, convex_z, reciprocal, condorcet, isr, combMNZ])
+
     experiment = pt.Experiment(
-            [sparse,
-             candidates >> convex,
-             candidates >> convex_mm,
-             candidates >> convex_z,
-             candidates >> reciprocal,
-             candidates >> condorcet,
-             candidates >> isr,
-             candidates >> combMNZ],
+            [sparse] + fusion.runs(candidates),
             dataset.get_topics(),
             dataset.get_qrels(),
             eval_metrics=[RR @ 10, nDCG @ 10, MAP @ 100],
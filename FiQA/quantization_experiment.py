@@ -0,0 +1,88 @@
+import pyterrier as pt
+from pathlib import Path
+import pandas as pd
+from fast_forward import Mode
+from fast_forward.encoder import TCTColBERTQueryEncoder
+from fast_forward.util.pyterrier import FFInterpolate
+
+from util.disk import OnDiskIndex
+from util.quantized import QuantizedIndex, quantize_index
+from util.FFBatchScore import FFBatchScore
+
+from pyterrier.measures import nDCG
+
+
+def main():
+    """
+    Running quantization experiment on FiQA-2018: memory of the vectors and nDCG@10 of BM25 >> Convex per storage method
+    """
+    if not pt.started():
+        pt.init()
+
+    dataset = pt.get_dataset('irds:beir/fiqa/test')
+    max_doc_len = 6
+
+    indexer = pt.IterDictIndexer(
+        str(Path.cwd()),  # this will be ignored
+        type=pt.index.IndexingType.MEMORY,
+        meta={'docno': max_doc_len}
+    )
+
+    index_ref = indexer.index(dataset, fields=['text'])
+    bm25 = pt.BatchRetrieve(index_ref, wmodel="BM25")
+
+    index_path = Path("ffindex_fiqa_tct.h5")
+    q_encoder = TCTColBERTQueryEncoder("castorini/tct_colbert-msmarco")
+
+    num_candidates = 100
+    sparse = (~bm25 % num_candidates)(dataset.get_topics())
+
+    ff_index = OnDiskIndex.load(index_path, query_encoder=q_encoder, mode=Mode.MAXP)
+    indexes = {"float32": (ff_index, len(ff_index) * ff_index.dim * 4)}
+    for method in ["float16", "int8", "pq"]:
+        quantized_path = index_path.with_name(f"{index_path.stem}_{method}.h5")
+        if not quantized_path.exists():
+            quantize_index(index_path, quantized_path, method)
+        quantized = QuantizedIndex.load(quantized_path, in_memory=True, query_encoder=q_encoder, mode=Mode.MAXP)
+        indexes[method] = (quantized, quantized.nbytes)
+
+    res = []
+    for method, (index, nbytes) in indexes.items():
+        candidates = FFBatchScore(index)(sparse)
+        experiment = pt.Experiment(
+            [candidates >> FFInterpolate(alpha=0.1)],
+            dataset.get_topics(),
+            dataset.get_qrels(),
+            eval_metrics=[nDCG @ 10],
+            names=[f"BM25 >> Convex ({method})"]
+        )
+        experiment["storage"] = method
+        experiment["vector_bytes"] = nbytes
+        res.append(experiment)
+        index.close()
+
+    output_to_file(report(res))
+
+
+def report(res):
+    """
+    Adds the memory reduction and the nDCG@10 delta with respect to float32 storage
+    :param res: list of experiment results, float32 first
+    :return: pd.DataFrame
+    """
+    df = pd.concat(res, ignore_index=True)
+    df["memory_reduction"] = df["vector_bytes"].iloc[0] / df["vector_bytes"]
+    df["nDCG@10_delta"] = df["nDCG@10"] - df["nDCG@10"].iloc[0]
+    return df
+
+
+def output_to_file(res):
+    """
+    Converts the result to a csv file
+    :param res: pd.DataFrame storing the report
+    """
+    res.to_csv("FiQA_quantization_experiment.csv", index=False)
+
+
+if __name__ == '__main__':
+    main()
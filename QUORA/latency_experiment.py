@@ -4,10 +4,12 @@ import os
 import pyterrier as pt
 from pathlib import Path
 import pandas as pd
-from fast_forward import OnDiskIndex, Mode
+from fast_forward import Mode
 from fast_forward.encoder import TCTColBERTQueryEncoder
 from fast_forward.util.pyterrier import FFScore, FFInterpolate
 
+from util.disk import OnDiskIndex
+from util.CachedIndex import CachedIndex
 from util.CondorcetFuseInterpolate import CondorcetFuseInterpolate
 from util.FFMinMaxInterpolate import FFMinMaxInterpolate
 from util.FFZScoreInterpolate import FFZScoreInterpolate
@@ -39,13 +41,23 @@ def main():
         Path(index_path), query_encoder=q_encoder, mode=Mode.MAXP
     )
 
+    # the disk index with a cache of the hot vectors is timed against the index in memory
+    ff_cached_score = FFScore(CachedIndex(ff_index, max_bytes=2 ** 28, policy="arc"))
     ff_index = ff_index.to_memory()
     ff_score = FFScore(ff_index)
     num_candidates = 100
     sample = dataset.get_topics().sample(n=100, random_state=42)
 
-    candidates = (~bm25 % num_candidates)(sample)
-    candidates = ff_score(candidates)
+    sparse = (~bm25 % num_candidates)(sample)
+    candidates = ff_score(sparse)
+    ff_score_time = timeit.repeat(stmt="ff_score(sparse)",
+                                  repeat=4,
+                                  number=3,
+                                  globals=locals())
+    ff_score_cached_time = timeit.repeat(stmt="ff_cached_score(sparse)",
+                                         repeat=4,
+                                         number=3,
+                                         globals=locals())
     convex_z_time = timeit.repeat(stmt="convex_z(candidates, dataset)",
                                   setup="from __main__ import convex_z",
                                   repeat=4,
@@ -84,6 +96,8 @@ def main():
 
 
     data = {
+        'ff_score_time': ff_score_time,
+        'ff_score_cached_time': ff_score_cached_time,
         'convex_time': convex_time,
         'convex_mm_time': convex_mm_time,
         'convex_z_time': convex_z_time,
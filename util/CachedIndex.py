@@ -0,0 +1,343 @@
+import abc
+import heapq
+import logging
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Sequence, Set, Tuple, Union
+
+import numpy as np
+from fast_forward.index import Index, Mode
+
+LOGGER = logging.getLogger(__name__)
+
+
+class VectorCache(abc.ABC):
+    """Cache of the vectors of documents (or passages) with a memory budget.
+    Subclasses implement the eviction policy; entries larger than the budget are never cached.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        """Create a VectorCache.
+
+        Args:
+            max_bytes (int): Maximum total size of the cached vectors in bytes.
+        """
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @abc.abstractmethod
+    def __len__(self) -> int:
+        """Return the number of cached IDs."""
+        pass
+
+    @abc.abstractmethod
+    def __contains__(self, id: str) -> bool:
+        """Return whether the vectors of an ID are cached, without counting it as an access."""
+        pass
+
+    @abc.abstractmethod
+    def _lookup(self, id: str) -> Union[np.ndarray, None]:
+        """Return the cached vectors of an ID and record the access, None if they are not cached."""
+        pass
+
+    @abc.abstractmethod
+    def _insert(self, id: str, vectors: np.ndarray) -> None:
+        """Add the vectors of an ID that is not cached, the budget is checked by `put`."""
+        pass
+
+    @abc.abstractmethod
+    def _evict(self) -> None:
+        """Remove the entry chosen by the eviction policy, updating `nbytes`."""
+        pass
+
+    def get(self, id: str) -> Union[np.ndarray, None]:
+        """Return the cached vectors of an ID.
+
+        Args:
+            id (str): The document or passage ID.
+
+        Returns:
+            Union[np.ndarray, None]: The vectors, None if they are not cached.
+        """
+        vectors = self._lookup(id)
+        if vectors is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return vectors
+
+    def put(self, id: str, vectors: np.ndarray) -> None:
+        """Cache the vectors of an ID, evicting other entries if necessary.
+
+        Args:
+            id (str): The document or passage ID.
+            vectors (np.ndarray): Its vectors.
+        """
+        if vectors.nbytes > self.max_bytes or id in self:
+            return
+        self._insert(id, vectors)
+        self.nbytes += vectors.nbytes
+        while self.nbytes > self.max_bytes:
+            self._evict()
+            self.evictions += 1
+
+    def clear(self) -> None:
+        """Remove all entries, the statistics are kept."""
+        hits, misses, evictions = self.hits, self.misses, self.evictions
+        self.__init__(self.max_bytes)
+        self.hits, self.misses, self.evictions = hits, misses, evictions
+
+    def stats(self) -> Dict[str, float]:
+        """Return the hit, miss and eviction counts, the hit rate and the memory usage."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+            "entries": len(self),
+            "nbytes": self.nbytes,
+        }
+
+
+class LRUCache(VectorCache):
+    """VectorCache that evicts the least recently used entry."""
+
+    def __init__(self, max_bytes: int) -> None:
+        super().__init__(max_bytes)
+        self._cache = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def __contains__(self, id: str) -> bool:
+        return id in self._cache
+
+    def _lookup(self, id: str) -> Union[np.ndarray, None]:
+        if id not in self._cache:
+            return None
+        self._cache.move_to_end(id)
+        return self._cache[id]
+
+    def _insert(self, id: str, vectors: np.ndarray) -> None:
+        self._cache[id] = vectors
+
+    def _evict(self) -> None:
+        _, vectors = self._cache.popitem(last=False)
+        self.nbytes -= vectors.nbytes
+
+
+class LFUCache(VectorCache):
+    """VectorCache that evicts the least frequently used entry, the oldest one on ties."""
+
+    def __init__(self, max_bytes: int) -> None:
+        super().__init__(max_bytes)
+        self._cache = {}
+        self._counts = {}
+        # (count, tick, id), entries with an outdated count are skipped on eviction
+        self._heap = []
+        self._tick = 0
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def __contains__(self, id: str) -> bool:
+        return id in self._cache
+
+    def _push(self, id: str) -> None:
+        self._tick += 1
+        heapq.heappush(self._heap, (self._counts[id], self._tick, id))
+
+    def _lookup(self, id: str) -> Union[np.ndarray, None]:
+        if id not in self._cache:
+            return None
+        self._counts[id] += 1
+        self._push(id)
+        return self._cache[id]
+
+    def _insert(self, id: str, vectors: np.ndarray) -> None:
+        self._cache[id] = vectors
+        self._counts[id] = 1
+        self._push(id)
+
+    def _evict(self) -> None:
+        while True:
+            count, _, id = heapq.heappop(self._heap)
+            if id in self._cache and self._counts[id] == count:
+                break
+        self.nbytes -= self._cache.pop(id).nbytes
+        del self._counts[id]
+
+        # drop outdated heap entries once they dominate the heap
+        if len(self._heap) > 4 * len(self._cache) + 64:
+            self._heap = [(self._counts[i], t, i) for c, t, i in self._heap if i in self._cache and self._counts[i] == c]
+            heapq.heapify(self._heap)
+
+
+class ARCCache(VectorCache):
+    """VectorCache with adaptive replacement (ARC), weighted by the size of the entries in bytes.
+
+    Entries seen once are kept in `t1`, entries seen again in `t2`. The IDs of entries evicted from them are
+    remembered in the ghost lists `b1` and `b2`; a miss on a ghost shifts the target size `p` of `t1` towards the
+    list that would have kept it.
+
+    ARC counts entries: with a cache of c entries, |t1| + |b1| <= c and |t1| + |t2| + |b1| + |b2| <= 2c. Here the
+    entries are documents with any number of passages, so c is the budget in bytes and all four lists are measured
+    in bytes of vectors instead: |t1| + |b1| <= c and, as |t1| + |t2| <= c, |b1| + |b2| <= c, with `p` in bytes as
+    well. With vectors of the same size per entry, e.g. in passage mode, this is ARC with c entries of that size.
+    More information: https://www.usenix.org/conference/fast-03/arc-self-tuning-low-overhead-replacement-cache
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        super().__init__(max_bytes)
+        self._t1, self._t2 = OrderedDict(), OrderedDict()
+        self._b1, self._b2 = OrderedDict(), OrderedDict()
+        self._t1_bytes, self._b1_bytes, self._b2_bytes = 0, 0, 0
+        self._p = 0.0
+        self._from_b2 = False
+
+    def __len__(self) -> int:
+        return len(self._t1) + len(self._t2)
+
+    def __contains__(self, id: str) -> bool:
+        return id in self._t1 or id in self._t2
+
+    def _lookup(self, id: str) -> Union[np.ndarray, None]:
+        if id in self._t1:
+            vectors = self._t1.pop(id)
+            self._t1_bytes -= vectors.nbytes
+            self._t2[id] = vectors
+            return vectors
+        if id in self._t2:
+            self._t2.move_to_end(id)
+            return self._t2[id]
+        return None
+
+    def put(self, id: str, vectors: np.ndarray) -> None:
+        if id in self._b1:
+            self._p = min(self.max_bytes, self._p + max(self._b2_bytes / self._b1_bytes, 1) * vectors.nbytes)
+        elif id in self._b2:
+            self._p = max(0.0, self._p - max(self._b1_bytes / self._b2_bytes, 1) * vectors.nbytes)
+        self._from_b2 = id in self._b2
+        super().put(id, vectors)
+
+        # the byte-weighted bounds of the ghost lists, see the class docstring
+        while self._b1 and self._t1_bytes + self._b1_bytes > self.max_bytes:
+            self._b1_bytes -= self._b1.popitem(last=False)[1]
+        while self._b2 and self._b1_bytes + self._b2_bytes > self.max_bytes:
+            self._b2_bytes -= self._b2.popitem(last=False)[1]
+
+    def _insert(self, id: str, vectors: np.ndarray) -> None:
+        if id in self._b1:
+            self._b1_bytes -= self._b1.pop(id)
+            self._t2[id] = vectors
+        elif id in self._b2:
+            self._b2_bytes -= self._b2.pop(id)
+            self._t2[id] = vectors
+        else:
+            self._t1[id] = vectors
+            self._t1_bytes += vectors.nbytes
+
+    def _evict(self) -> None:
+        if self._t1 and (self._t1_bytes > self._p or (self._from_b2 and self._t1_bytes == self._p) or not self._t2):
+            id, vectors = self._t1.popitem(last=False)
+            self._t1_bytes -= vectors.nbytes
+            self._b1[id] = vectors.nbytes
+            self._b1_bytes += vectors.nbytes
+        else:
+            id, vectors = self._t2.popitem(last=False)
+            self._b2[id] = vectors.nbytes
+            self._b2_bytes += vectors.nbytes
+        self.nbytes -= vectors.nbytes
+
+
+POLICIES = {"lru": LRUCache, "lfu": LFUCache, "arc": ARCCache}
+
+
+class CachedIndex(Index):
+    """Fast-Forward index that caches the vectors of another index, e.g. an `OnDiskIndex`.
+
+    Vectors that are not cached are fetched from the wrapped index with a single `_get_vectors` call per batch.
+    Changing the mode clears the cache, as the cached vectors depend on it.
+    """
+
+    def __init__(self, index: Index, max_bytes: int = 2 ** 30, policy: str = "lru") -> None:
+        """Create a CachedIndex.
+
+        Args:
+            index (Index): The index to cache.
+            max_bytes (int, optional): Maximum total size of the cached vectors in bytes. Defaults to 2**30.
+            policy (str, optional): Eviction policy, "lru", "lfu" or "arc". Defaults to "lru".
+
+        Raises:
+            ValueError: When the eviction policy is not supported.
+        """
+        if policy not in POLICIES:
+            raise ValueError(f"Unsupported eviction policy {policy}.")
+        self._index = index
+        self.cache = POLICIES[policy](max_bytes)
+        super().__init__(index.query_encoder, index.mode, index._encoder_batch_size)
+
+    @property
+    def mode(self) -> Mode:
+        return self._index.mode
+
+    @mode.setter
+    def mode(self, mode: Mode) -> None:
+        if mode != self._index.mode:
+            self.cache.clear()
+        self._index.mode = mode
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    @property
+    def dim(self) -> int:
+        return self._index.dim
+
+    def _add(
+            self,
+            vectors: np.ndarray,
+            doc_ids: Union[Sequence[str], None],
+            psg_ids: Union[Sequence[str], None],
+    ) -> None:
+        self._index._add(vectors, doc_ids, psg_ids)
+        self.cache.clear()
+
+    def _get_doc_ids(self) -> Set[str]:
+        return self._index.doc_ids
+
+    def _get_psg_ids(self) -> Set[str]:
+        return self._index.psg_ids
+
+    def _get_vectors(self, ids: Iterable[str]) -> Tuple[np.ndarray, List[List[int]]]:
+        ids = list(ids)
+        found = {}
+        missing = []
+        for id in ids:
+            vectors = self.cache.get(id)
+            if vectors is None:
+                missing.append(id)
+            else:
+                found[id] = vectors
+
+        if len(missing) > 0:
+            vectors, id_to_idxs = self._index._get_vectors(missing)
+            # IDs without vectors are not cached
+            for id, idxs in zip(missing, id_to_idxs):
+                if len(idxs) > 0:
+                    found[id] = vectors[idxs]
+                    self.cache.put(id, found[id])
+
+        dtype = next(iter(found.values())).dtype if len(found) > 0 else np.float32
+        result, id_to_idxs, c = [], [], 0
+        for id in ids:
+            vectors = found.get(id, np.zeros((0, self.dim), dtype=dtype))
+            result.append(vectors)
+            id_to_idxs.append(list(range(c, c + len(vectors))))
+            c += len(vectors)
+        if len(result) == 0:
+            return np.zeros((0, self.dim), dtype=dtype), id_to_idxs
+        return np.concatenate(result), id_to_idxs
@@ -1,6 +1,8 @@
 import pyterrier as pt
 import pandas as pd
 
+from util.rank import descending_rank
+
 
 class CombMNZInterpolate(pt.Transformer):
     """PyTerrier transformer that interpolates scores computed by `FFScore`."""
@@ -22,7 +24,7 @@ class CombMNZInterpolate(pt.Transformer):
             pd.DataFrame: A new data frame with the interpolated scores.
         """
         new_df = df[["qid", "docno", "query"]].copy()
-        df['s_rank'] = df.groupby('qid')['score_0'].rank(ascending=False)
-        df['l_rank'] = df.groupby('qid')['score'].rank(ascending=False)
-        new_df["score"] = 2 * ((self.num_candidates - df['l_rank'] + 1) + (self.num_candidates - df['s_rank'] + 1))
+        s_rank = descending_rank(df, 'score_0')
+        l_rank = descending_rank(df, 'score')
+        new_df["score"] = 2 * ((self.num_candidates - l_rank + 1) + (self.num_candidates - s_rank + 1))
         return new_df
\ No newline at end of file
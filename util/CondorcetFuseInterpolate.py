@@ -3,6 +3,79 @@ import pandas as pd
 import pyterrier as pt
 
 
+def condorcet_wins(qids: np.ndarray, score_0: np.ndarray, score: np.ndarray) -> np.ndarray:
+    """Count the pairwise Condorcet wins of every document against the other documents of its query.
+    A document wins against another one if both its lexical and its semantic score are strictly higher.
+
+    The counts are computed for all queries at once. The rows are sorted by (query, lexical score, semantic score
+    descending), so that every document that precedes a row in its query has a lower or equal lexical score and, on
+    ties, a higher or equal semantic score. A Fenwick tree per query over the dense semantic ranks then counts the
+    preceding documents with a strictly lower semantic score. The k-th document of every query is processed in the
+    same vectorized step, hence the number of Python-level steps only depends on the query depth.
+
+    Args:
+        qids (np.ndarray): The query IDs.
+        score_0 (np.ndarray): The lexical scores.
+        score (np.ndarray): The semantic scores.
+
+    Returns:
+        np.ndarray: The number of wins of every row.
+    """
+    n = len(qids)
+    wins = np.zeros(n, dtype=np.int64)
+    score_0 = np.asarray(score_0, dtype=np.float64)
+    score = np.asarray(score, dtype=np.float64)
+
+    # comparisons with NaN are always false, so those rows neither win nor lose
+    valid = np.flatnonzero(~(np.isnan(score_0) | np.isnan(score)))
+    if len(valid) == 0:
+        return wins
+    groups = pd.factorize(qids[valid])[0]
+    x, y = score_0[valid], score[valid]
+
+    # dense rank (starting at 1) of the semantic score within the query
+    order = np.lexsort((y, groups))
+    new_value = np.ones(len(order), dtype=bool)
+    new_value[1:] = (y[order][1:] != y[order][:-1]) | (groups[order][1:] != groups[order][:-1])
+    new_group = np.ones(len(order), dtype=bool)
+    new_group[1:] = groups[order][1:] != groups[order][:-1]
+    dense = np.cumsum(new_value)
+    dense -= np.maximum.accumulate(np.where(new_group, dense - 1, 0))
+    y_rank = np.empty(len(order), dtype=np.int64)
+    y_rank[order] = dense
+
+    # sweep the rows of each query in ascending lexical order, ties ordered by descending semantic score
+    order = np.lexsort((-y, x, groups))
+    sizes = np.bincount(groups)
+    starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    tree = np.zeros((len(sizes), sizes.max() + 1), dtype=np.int32)
+    for k in range(sizes.max()):
+        active = np.flatnonzero(sizes > k)
+        rows = order[starts[active] + k]
+        ranks = y_rank[rows]
+
+        # count the swept documents with a strictly lower semantic rank
+        counts = np.zeros(len(active), dtype=np.int64)
+        pos = ranks - 1
+        while True:
+            todo = pos > 0
+            if not todo.any():
+                break
+            counts[todo] += tree[active[todo], pos[todo]]
+            pos[todo] -= pos[todo] & -pos[todo]
+        wins[valid[rows]] = counts
+
+        # insert the current documents
+        pos = ranks.copy()
+        while True:
+            todo = pos < tree.shape[1]
+            if not todo.any():
+                break
+            tree[active[todo], pos[todo]] += 1
+            pos[todo] += pos[todo] & -pos[todo]
+    return wins
+
+
 class CondorcetFuseInterpolate(pt.Transformer):
     """PyTerrier transformer that interpolates scores computed by `FFScore`."""
 
@@ -16,34 +89,6 @@ class CondorcetFuseInterpolate(pt.Transformer):
         self.alpha = alpha
         super().__init__()
 
-    def sortCondorcet(self, group, l_max, s_max, l_min, s_min):
-        """Computes the preference relationship of the documents and returns the aggregated score
-
-                    Args:
-                        group (pd.DataFrame): The PyTerrier data frame.
-                        l_max (float): maximum lexical score
-                        s_max (float): maximum semantic score
-                        l_mim (float): minimum lexical score
-                        s_min (float): minimum semantic score
-
-                    Returns:
-                        pd.DataFrame: A new data frame with the aggregated scores.
-        """
-        score_mat = pd.DataFrame(np.zeros((len(group), len(group))), index=group['docno'], columns=group['docno'])
-        score_mat['interpolation'] = np.zeros(len(group))
-        for i, doc1 in group.iterrows():
-            score_mat.at[doc1['docno'], 'interpolation'] = self.alpha * (
-                        (doc1['score_0'] - l_min) / (l_max - l_min)) + (1 - self.alpha) * (
-                                                                       (doc1['score'] - s_min) / (s_max - s_min))
-            for j, doc2 in group.iterrows():
-                if i < j:
-                    if doc1['score_0'] < doc2['score_0'] and doc1['score'] < doc2['score']:
-                        score_mat.at[doc2['docno'], doc1['docno']] += 1
-                    if doc1['score_0'] > doc2['score_0'] and doc1['score'] > doc2['score']:
-                        score_mat.at[doc1['docno'], doc2['docno']] += 1
-        score_mat['score'] = score_mat.sum(axis=1)
-        return score_mat.loc[:, 'score']
-
     def transform(self, df: pd.DataFrame) -> pd.DataFrame:
         """Interpolate the scores for all query-document pairs in the data frame as
         `number of wins in the preference relationship + normalized convex rank fusion score`.
@@ -52,18 +97,24 @@ class CondorcetFuseInterpolate(pt.Transformer):
             df (pd.DataFrame): The PyTerrier data frame.
 
         Returns:
-            pd.DataFrame: A new data frame with the interpolated scores.
+            pd.DataFrame: A new data frame with the aggregated scores, grouped by query.
         """
+        l_max = df['score_0'].max()
+        s_max = df['score'].max()
 
-        l_max = max(df['score_0'])
-        s_max = max(df['score'])
+        l_min = df['score_0'].min()
+        s_min = df['score'].min()
 
-        l_min = min(df['score_0'])
-        s_min = min(df['score'])
+        score_0 = df['score_0'].to_numpy(dtype=np.float64)
+        score = df['score'].to_numpy(dtype=np.float64)
+        interpolation = self.alpha * ((score_0 - l_min) / (l_max - l_min)) + (1 - self.alpha) * (
+                (score - s_min) / (s_max - s_min))
+        # missing interpolation scores do not count towards the sum, as in pd.DataFrame.sum
+        scores = condorcet_wins(df['qid'].to_numpy(), score_0, score) + np.nan_to_num(
+            interpolation, nan=0.0, posinf=np.inf, neginf=-np.inf)
 
-        new_rows = []
-        for _, group in df.groupby('qid'):
-            scores = self.sortCondorcet(group, l_max, s_max, l_min, s_min)
-            new_rows.extend(zip(group['qid'], group['docno'], group['query'], scores))
-        new_df = pd.DataFrame(new_rows, columns=['qid', 'docno', 'query', 'score'])
+        # keep the output grouped by query (in sorted order), like pd.DataFrame.groupby
+        order = np.argsort(pd.factorize(df['qid'], sort=True)[0], kind='stable')
+        new_df = df[['qid', 'docno', 'query']].iloc[order].reset_index(drop=True)
+        new_df['score'] = scores[order]
         return new_df
@@ -1,12 +1,17 @@
-import pyterrier as pt
 from fast_forward.util.pyterrier import FFInterpolate
 from pyterrier.measures import RR, nDCG, MAP
 
+from util.CondorcetFuseInterpolate import CondorcetFuseInterpolate
 from util.FFMinMaxInterpolate import FFMinMaxInterpolate
 from util.FFZScoreInterpolate import FFZScoreInterpolate
+from util.Evaluator import Evaluator
+from util.MultiFusion import FusionStatistics
+from util.sweep import sweep, grid_search
 
 class ConvexExperiment(object):
     """Object that facilitates in experiments for convex rank fusion functions"""
+    grid = [0.0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0]
+
     def __init__(self, candidates, dataset, num_candidates=100):
         """
         Creates the ConvexExperiment object.
@@ -17,6 +22,8 @@ class ConvexExperiment(object):
         self.candidates = candidates
         self.dataset = dataset
         self.num_candidates = num_candidates
+        self.stats = FusionStatistics(candidates)
+        self.evaluator = Evaluator(candidates, dataset.get_qrels())
 
     def identity_validation(self, alpha=0.5):
         """
@@ -45,37 +52,21 @@ class ConvexExperiment(object):
         """
         return self.validation(FFZScoreInterpolate(alpha))
 
-    def validation(self, ff_int):
+    def condorcet_validation(self, alpha=0.5):
+        """
+        Validation on CondorcetFuseInterpolate
+        :param alpha: parameter for the CondorcetFuseInterpolate transformer
+        :return: validation result
+        """
+        return self.validation(CondorcetFuseInterpolate(alpha))
+
+    def validation(self, ff_int, metrics=("map", "recip_rank", "ndcg_cut.10")):
         """
         Validation on the ff_int using map, recip_rank, and nDCG@10
+        Every grid point is scored and evaluated once for all metrics.
         :param ff_int: Interpolate transformer used for validation
+        :param metrics: metrics to find the best alpha for
         :return: Validation result for all metric
         """
-        pt.GridSearch(
-            self.candidates >> ff_int,
-            {ff_int: {"alpha": [0.0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0]}},
-            self.dataset.get_topics(),
-            self.dataset.get_qrels(),
-            "map",
-            verbose=True,
-        )
-        alpha_map = ff_int.alpha
-        pt.GridSearch(
-            self.candidates >> ff_int,
-            {ff_int: {"alpha": [0.0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0]}},
-            self.dataset.get_topics(),
-            self.dataset.get_qrels(),
-            "recip_rank",
-            verbose=True,
-        )
-        alpha_RR = ff_int.alpha
-        pt.GridSearch(
-            self.candidates >> ff_int,
-            {ff_int: {"alpha": [0.0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0]}},
-            self.dataset.get_topics(),
-            self.dataset.get_qrels(),
-            "ndcg_cut.10",
-            verbose=True,
-        )
-        alpha_nDCG = ff_int.alpha
-        return [alpha_map, alpha_RR, alpha_nDCG]
\ No newline at end of file
+        scores = sweep(ff_int, self.stats, self.grid)
+        return grid_search(self.evaluator, scores, self.grid, metrics)
@@ -0,0 +1,93 @@
+import logging
+import zlib
+from pathlib import Path
+from typing import Dict, Iterable, Iterator
+
+import h5py
+import numpy as np
+import pandas as pd
+
+LOGGER = logging.getLogger(__name__)
+
+
+class DocnoDictionary(object):
+    """Dictionary that maps the docnos of a corpus to codes, their position in the corpus.
+
+    This is positional string coding, not int32 IDs: the sparse index and the Fast-Forward index store the position
+    rendered as a decimal string instead of the docno, so both have short, ASCII-only IDs, and the candidate frames
+    carry these strings until the docnos are restored for evaluation. Only decoding goes through int32 positions.
+
+    As the codes are positions, every index has to be built from the corpus in the same order. `save_fingerprint`
+    records the number of docnos and a CRC-32 of all of them in corpus order in a Fast-Forward index file, and
+    `check_fingerprint` compares them with the corpus the dictionary was filled from.
+    """
+    # number of digits of the largest int32, used as the docno length of the sparse index
+    code_length = 10
+
+    def __init__(self) -> None:
+        """Create an empty DocnoDictionary, it is filled by `encode_corpus`."""
+        self._docnos = []
+        self._array = None
+        self._crc32 = 0
+
+    def __len__(self) -> int:
+        return len(self._docnos)
+
+    def encode_corpus(self, docs: Iterable[Dict[str, str]]) -> Iterator[Dict[str, str]]:
+        """Replace the docno of every document of the corpus by its code, recording the docnos.
+
+        Args:
+            docs (Iterable[Dict[str, str]]): The documents, e.g. `dataset.get_corpus_iter()`.
+
+        Yields:
+            Dict[str, str]: The documents with their code as docno.
+        """
+        self._docnos, self._array, self._crc32 = [], None, 0
+        for code, d in enumerate(docs):
+            self._docnos.append(d["docno"])
+            self._crc32 = zlib.crc32(d["docno"].encode("utf-8") + b"\n", self._crc32)
+            d["docno"] = str(code)
+            yield d
+
+    def decode(self, codes: pd.Series) -> np.ndarray:
+        """Return the docnos of codes.
+
+        Args:
+            codes (pd.Series): The codes, as strings or integers.
+
+        Returns:
+            np.ndarray: The docnos.
+        """
+        if self._array is None:
+            self._array = np.asarray(self._docnos, dtype=object)
+        return self._array[codes.to_numpy().astype(np.int32)]
+
+    def save_fingerprint(self, index_file: Path) -> None:
+        """Record the number of docnos and their checksum in an index file, once the whole corpus was encoded.
+
+        Args:
+            index_file (Path): The Fast-Forward index file, it must not be open.
+        """
+        with h5py.File(index_file, "a") as fp:
+            fp.attrs["docno_count"] = len(self._docnos)
+            fp.attrs["docno_crc32"] = self._crc32
+
+    def check_fingerprint(self, index_file: Path) -> None:
+        """Check that the codes of an index file were assigned in the order of the encoded corpus.
+
+        Args:
+            index_file (Path): The Fast-Forward index file.
+
+        Raises:
+            ValueError: When the index was built from a corpus with other docnos or in another order.
+        """
+        with h5py.File(index_file, "r") as fp:
+            if "docno_crc32" not in fp.attrs:
+                LOGGER.warning("%s has no docno fingerprint, the order of the corpus cannot be checked", index_file)
+                return
+            count, crc32 = int(fp.attrs["docno_count"]), int(fp.attrs["docno_crc32"])
+        if count != len(self._docnos) or crc32 != self._crc32:
+            raise ValueError(
+                f"{index_file} was built from {count} docnos with checksum {crc32}, but the corpus has {len(self)} "
+                f"docnos with checksum {self._crc32}. The codes are positions, so the index has to be rebuilt."
+            )
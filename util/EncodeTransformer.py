@@ -1,15 +1,19 @@
-import ast
-
 import pyterrier as pt
 import pandas as pd
 
+from util.DocnoDictionary import DocnoDictionary
+
 
 class EncodeTransformer(pt.Transformer):
     """PyTerrier transformer that provides decoding on the encoded document information."""
 
-    def __init__(self) -> None:
+    def __init__(self, docnos: DocnoDictionary) -> None:
         """Create an EncodeTransformer transformer.
+
+        Args:
+            docnos (DocnoDictionary): The dictionary the docnos were encoded with.
         """
+        self._docnos = docnos
         super().__init__()
 
     def transform(self, df: pd.DataFrame) -> pd.DataFrame:
@@ -18,9 +22,6 @@ class EncodeTransformer(pt.Transformer):
         :param df: pd.DataFrame
         :return: pd.DataFrame
         """
-        df['docno'] = df['docno'].apply(lambda x: ast.literal_eval(x).decode("utf-8"))
+        df = df.copy()
+        df['docno'] = self._docnos.decode(df['docno'])
         return df
-
-
-
-
@@ -0,0 +1,159 @@
+import re
+from typing import Dict, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+METRIC_PATTERN = re.compile(r"^(?P<name>RR|nDCG|AP)(\(rel=(?P<rel>\d+)\))?(@(?P<cutoff>\d+))?$")
+TREC_METRICS = {"map": "AP", "recip_rank": "RR", "ndcg": "nDCG"}
+
+
+def parse_metric(metric) -> Tuple[str, int, Union[int, None]]:
+    """Parse a metric given as trec_eval name ("map", "recip_rank", "ndcg_cut.10") or as PyTerrier measure (`nDCG @ 10`).
+
+    Args:
+        metric: The metric.
+
+    Raises:
+        KeyError: When the metric is not supported.
+
+    Returns:
+        Tuple[str, int, Union[int, None]]: The measure ("AP", "RR" or "nDCG"), the minimum relevance level and the cutoff.
+    """
+    name = str(metric)
+    if name in TREC_METRICS:
+        return TREC_METRICS[name], 1, None
+    match = re.match(r"^(map|ndcg)_cut[._](\d+)$", name)
+    if match is not None:
+        return TREC_METRICS[match.group(1)], 1, int(match.group(2))
+    match = METRIC_PATTERN.match(name)
+    if match is None or (match.group("name") == "nDCG" and match.group("rel") is not None):
+        raise KeyError(f"Unsupported metric {name}.")
+    return (
+        match.group("name"),
+        int(match.group("rel") or 1),
+        int(match.group("cutoff")) if match.group("cutoff") is not None else None,
+    )
+
+
+class Evaluator(object):
+    """Evaluates many runs over the same candidates at once, with the same results as PyTerrier.
+
+    The qrels are compiled once into relevance labels aligned with the candidate rows. Each run is a score
+    column for these rows. Like pytrec_eval, the rows are ranked per query by descending score and descending
+    docno on ties; RR with a cutoff follows the MS MARCO evaluation script that PyTerrier uses for it instead and
+    breaks ties by ascending docno. Like `pt.Evaluate`, the means are taken over all queries in the qrels, queries
+    without candidates count as 0.
+    """
+
+    def __init__(self, candidates: pd.DataFrame, qrels: pd.DataFrame) -> None:
+        """Create an Evaluator.
+
+        Args:
+            candidates (pd.DataFrame): The PyTerrier data frame with "qid" and "docno" columns the runs are computed for.
+            qrels (pd.DataFrame): The relevance judgements with "qid", "docno" and "label" columns.
+        """
+        qids = candidates["qid"].astype(str).to_numpy()
+        docnos = candidates["docno"].astype(str).to_numpy()
+        qrels = qrels[["qid", "docno", "label"]].astype({"qid": str, "docno": str})
+        qrels = qrels.drop_duplicates(["qid", "docno"], keep="last")
+        self.num_rows = len(candidates)
+        self.num_queries = qrels["qid"].nunique()
+
+        rows = np.flatnonzero(pd.Series(qids).isin(qrels["qid"]).to_numpy())
+        groups, self.qids = pd.factorize(qids[rows])
+        labels = (
+            pd.DataFrame({"qid": qids[rows], "docno": docnos[rows]})
+            .merge(qrels, on=["qid", "docno"], how="left")["label"]
+            .fillna(0)
+            .to_numpy(dtype=np.float64)
+        )
+
+        # layouts[d][q, i] is the row of the i-th candidate of query q in descending (d=True) or ascending (d=False)
+        # docno order, padded with num_rows
+        docno_codes = pd.factorize(docnos[rows], sort=True)[0]
+        sizes = np.bincount(groups, minlength=len(self.qids))
+        self._layouts, self._labels = {}, {}
+        for descending in (True, False):
+            order = np.lexsort((-docno_codes if descending else docno_codes, groups))
+            positions = np.arange(len(order)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+            self._layouts[descending] = np.full((len(self.qids), sizes.max(initial=0)), self.num_rows)
+            self._layouts[descending][groups[order], positions] = rows[order]
+            self._labels[descending] = np.zeros(self._layouts[descending].shape)
+            self._labels[descending][groups[order], positions] = labels[order]
+
+        # judged labels of each evaluated query, in descending order
+        qrels = qrels[qrels["qid"].isin(self.qids)]
+        judged_groups = pd.Index(self.qids).get_indexer(qrels["qid"])
+        judged_labels = qrels["label"].to_numpy(dtype=np.float64)
+        order = np.lexsort((-judged_labels, judged_groups))
+        sizes = np.bincount(judged_groups, minlength=len(self.qids))
+        positions = np.arange(len(order)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+        self._judged = np.zeros((len(self.qids), sizes.max(initial=0)))
+        self._judged[judged_groups[order], positions] = judged_labels[order]
+
+    def _rank(self, scores: np.ndarray, descending: bool) -> np.ndarray:
+        # sort by descending score, the stable sort keeps the docno order on ties
+        keys = -np.append(scores, np.nan)[self._layouts[descending]]
+        ranking = np.argsort(keys, axis=1, kind="stable")
+        return np.take_along_axis(self._labels[descending], ranking, axis=1)
+
+    @staticmethod
+    def _discounted_gain(labels: np.ndarray, cutoff: Union[int, None]) -> np.ndarray:
+        gains = np.maximum(labels[:, :cutoff], 0)
+        if gains.shape[1] == 0:
+            return np.zeros(gains.shape[0])
+        return np.cumsum(gains / np.log2(np.arange(gains.shape[1]) + 2), axis=1)[:, -1]
+
+    def _per_query(self, scores: np.ndarray, metric, rankings: Dict[bool, np.ndarray]) -> np.ndarray:
+        name, rel, cutoff = parse_metric(metric)
+        # PyTerrier computes RR with a cutoff through the MS MARCO evaluation script, which breaks ties by ascending docno
+        msmarco = name == "RR" and cutoff is not None
+        if msmarco not in rankings:
+            rankings[msmarco] = self._rank(scores, descending=not msmarco)
+        labels = rankings[msmarco]
+
+        if name == "nDCG":
+            ideal = self._discounted_gain(self._judged, cutoff)
+            dcg = self._discounted_gain(labels, cutoff)
+            return np.divide(dcg, ideal, out=np.zeros_like(dcg), where=ideal > 0)
+
+        relevant = labels[:, :cutoff] >= rel
+        num_rel = (self._judged >= rel).sum(axis=1)
+        if name == "RR":
+            first = np.argmax(relevant, axis=1)
+            rr = np.where(relevant.any(axis=1), 1 / (first + 1), 0.0)
+            return rr
+
+        if relevant.shape[1] == 0:
+            return np.zeros(labels.shape[0])
+        precision = np.cumsum(relevant, axis=1) / np.arange(1, relevant.shape[1] + 1)
+        ap = np.cumsum(np.where(relevant, precision, 0.0), axis=1)[:, -1]
+        return np.divide(ap, num_rel, out=np.zeros_like(ap), where=num_rel > 0)
+
+    def evaluate(self, scores: np.ndarray, metrics: Sequence, perquery: bool = False) -> Dict[str, np.ndarray]:
+        """Evaluate one or more runs.
+
+        Args:
+            scores (np.ndarray): The scores of the candidate rows, shape `(num_rows,)` or `(num_rows, num_runs)`.
+            metrics (Sequence): The metrics, as trec_eval names or PyTerrier measures.
+            perquery (bool, optional): Return the value of each query instead of the mean. Defaults to False.
+
+        Returns:
+            Dict[str, np.ndarray]: The mean value of each metric, one entry per run if `scores` is a matrix.
+                With `perquery=True`, an array of shape `(len(qids),)` or `(len(qids), num_runs)` per metric,
+                the queries are given by `self.qids`.
+        """
+        scores = np.asarray(scores, dtype=np.float64)
+        matrix = scores.reshape(self.num_rows, -1)
+        result = {str(metric): np.zeros((len(self.qids), matrix.shape[1])) for metric in metrics}
+        for j in range(matrix.shape[1]):
+            rankings = {}
+            for metric in metrics:
+                result[str(metric)][:, j] = self._per_query(matrix[:, j], metric, rankings)
+
+        for name, values in result.items():
+            if not perquery:
+                values = values.sum(axis=0) / self.num_queries if self.num_queries > 0 else np.full(matrix.shape[1], np.nan)
+            result[name] = values if scores.ndim == 2 else values[..., 0]
+        return result
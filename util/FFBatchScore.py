@@ -0,0 +1,219 @@
+import logging
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+import pyterrier as pt
+import torch
+from fast_forward.index import Index, Mode
+
+LOGGER = logging.getLogger(__name__)
+
+
+class FFBatchScore(pt.Transformer):
+    """PyTerrier transformer that computes scores using a Fast-Forward index, with the same output as `FFScore`.
+
+    The queries are processed in batches. The candidates of all queries in a batch are de-duplicated, so the
+    vectors of every document (or passage) are fetched with a single `_get_vectors` call per batch, which reads
+    them in sorted order, and are then scattered back to the query-document pairs. The de-duplication counters
+    `num_pairs`, `num_ids` and `num_vectors` accumulate over all calls.
+
+    The vectors of every document are a contiguous segment of the fetched vectors, given by CSR offsets, so the
+    passage scores of all pairs form a single vector that is aggregated with segmented reductions (`reduceat`).
+    Indexes with `_get_vectors_csr`, like `util.disk.OnDiskIndex`, return the offsets directly.
+
+    The passage scores are either computed with matrix products (GEMM) or by gathering the vectors of every pair. A
+    GEMM multiplies the stacked vectors of a block of `gemm_block_size` queries with the vectors the pairs of the block
+    need, each of them once, and the entries of the pairs are picked from the result. It computes the products of
+    every query of the block with every one of these vectors, so larger blocks only pay off when the queries share
+    many candidates. On CPU with 768-dimensional vectors and 100 to 1000 candidates per query, the scoring alone was
+    about 4 times faster than gathering with one query per block and 1 to 2 times faster with blocks of 4 to 64
+    queries. End to end, fetching the vectors dominates and blocks of 1 to 16 queries took the same time, about 20%
+    less than gathering, so the default stacks 16 queries per GEMM.
+
+    Indexes with `score_codes`, like `util.quantized.QuantizedIndex`, are scored on their codes, which are fetched
+    instead of the vectors.
+    """
+
+    def __init__(
+            self,
+            index: Index,
+            batch_size: int = 256,
+            scoring: str = "gemm",
+            gemm_block_size: int = 16,
+            num_threads: int = None,
+    ) -> None:
+        """Create an FFBatchScore transformer.
+
+        Args:
+            index (Index): The Fast-Forward index.
+            batch_size (int, optional): Number of queries whose candidates are fetched at once. Defaults to 256.
+            scoring (str, optional): "gemm" or "gather". Defaults to "gemm".
+            gemm_block_size (int, optional): Number of queries per matrix product. Defaults to 16.
+            num_threads (int, optional): Number of torch threads for the GEMM. Defaults to None (unchanged).
+
+        Raises:
+            ValueError: When the scoring method is unknown.
+        """
+        if scoring not in ("gemm", "gather"):
+            raise ValueError(f"Unknown scoring method {scoring}.")
+        self._index = index
+        self.batch_size = batch_size
+        self.scoring = scoring
+        self.gemm_block_size = gemm_block_size
+        self.num_threads = num_threads
+        self.num_gemms = 0
+        self.num_pairs = 0
+        self.num_ids = 0
+        self.num_vectors = 0
+        super().__init__()
+
+    @property
+    def dedup_ratio(self) -> float:
+        """Return the number of query-document pairs per fetched document, 1 means that nothing was shared."""
+        return self.num_pairs / self.num_ids if self.num_ids > 0 else 1.0
+
+    def _fetch(self, ids: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """Fetch the vectors of documents (or passages), grouped by ID.
+
+        Args:
+            ids (List[str]): The document (or passage) IDs.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The vectors and the offsets of the vectors of every ID.
+        """
+        if hasattr(self._index, "_get_vectors_csr"):
+            return self._index._get_vectors_csr(ids)
+
+        vectors, id_to_vec_idxs = self._index._get_vectors(ids)
+        # some indexes return no mapping at all if none of the IDs has vectors
+        counts = np.array([len(idxs) for idxs in id_to_vec_idxs] or [0] * len(ids), dtype=np.int64)
+        offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        vec_idxs = np.array([idx for idxs in id_to_vec_idxs for idx in idxs], dtype=np.int64)
+        return vectors[vec_idxs], offsets
+
+    def _gemm(
+            self, q_vectors: np.ndarray, pair_q_idxs: np.ndarray, vectors: np.ndarray, select: np.ndarray
+    ) -> np.ndarray:
+        """Compute the scores of query-vector pairs with one matrix product per block of queries.
+
+        Args:
+            q_vectors (np.ndarray): The query vectors.
+            pair_q_idxs (np.ndarray): The position of the query of every pair in `q_vectors`, in ascending order.
+            vectors (np.ndarray): The document (or passage) vectors.
+            select (np.ndarray): The position of the vector of every pair in `vectors`.
+
+        Returns:
+            np.ndarray: The scores.
+        """
+        scores = np.empty(len(select), dtype=np.float32)
+        block_size = self.gemm_block_size
+        bounds = np.searchsorted(pair_q_idxs, np.arange(0, len(q_vectors) + block_size, block_size))
+        num_threads = torch.get_num_threads()
+        if self.num_threads is not None:
+            torch.set_num_threads(self.num_threads)
+        try:
+            for q_lo, lo, hi in zip(range(0, len(q_vectors), block_size), bounds[:-1], bounds[1:]):
+                if lo == hi:
+                    continue
+                # the vectors the pairs of the block need, each of them once
+                columns, inverse = np.unique(select[lo:hi], return_inverse=True)
+                q_block = torch.from_numpy(np.ascontiguousarray(q_vectors[q_lo: q_lo + block_size]))
+                v_block = torch.from_numpy(np.ascontiguousarray(vectors[columns], dtype=q_vectors.dtype))
+                scores[lo:hi] = (q_block @ v_block.T).numpy()[pair_q_idxs[lo:hi] - q_lo, inverse]
+                self.num_gemms += 1
+        finally:
+            torch.set_num_threads(num_threads)
+        return scores
+
+    def _score_batch(self, q_vectors: np.ndarray, q_idxs: np.ndarray, ids: np.ndarray) -> np.ndarray:
+        """Compute the scores of a batch of query-document pairs.
+
+        Args:
+            q_vectors (np.ndarray): The vectors of the queries of the batch.
+            q_idxs (np.ndarray): The position of the query of every pair in `q_vectors`, in ascending order.
+            ids (np.ndarray): The document (or passage) ID of every pair.
+
+        Returns:
+            np.ndarray: The scores, NaN for documents without vectors.
+        """
+        unique_ids, inverse = np.unique(ids, return_inverse=True)
+        quantized = hasattr(self._index, "score_codes")
+        if quantized:
+            vectors, offsets = self._index._get_codes_csr(unique_ids.tolist())
+        else:
+            vectors, offsets = self._fetch(unique_ids.tolist())
+        counts = np.diff(offsets)
+        self.num_pairs += len(ids)
+        self.num_ids += len(unique_ids)
+        self.num_vectors += len(vectors)
+
+        result = np.full(len(ids), np.nan)
+        pair_counts = counts[inverse]
+        found = np.flatnonzero(pair_counts > 0)
+        if len(found) == 0:
+            return result
+
+        # one dot product per pair and vector of its document, the segment of a pair starts at firsts
+        firsts = np.cumsum(pair_counts) - pair_counts
+        select = np.arange(pair_counts.sum()) - np.repeat(firsts - offsets[:-1][inverse], pair_counts)
+        pair_q_idxs = np.repeat(q_idxs, pair_counts)
+        if quantized:
+            scores = self._index.score_codes(q_vectors, pair_q_idxs, vectors[select])
+        elif self.scoring == "gemm":
+            scores = self._gemm(q_vectors, pair_q_idxs, vectors, select)
+        else:
+            scores = np.sum(q_vectors[pair_q_idxs] * vectors[select], axis=1)
+
+        # aggregate the scores of each pair based on the mode
+        if self._index.mode == Mode.MAXP:
+            result[found] = np.maximum.reduceat(scores, firsts[found])
+        elif self._index.mode == Mode.AVEP:
+            result[found] = np.add.reduceat(scores, firsts[found]) / pair_counts[found].astype(scores.dtype)
+        else:
+            result[found] = scores[firsts[found]]
+        return result
+
+    def transform(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Compute the scores for all query-document pairs in the data frame.
+        The previous scores are moved to the "score_0" column.
+
+        Args:
+            df (pd.DataFrame): The PyTerrier data frame.
+
+        Returns:
+            pd.DataFrame: A new data frame with the computed scores.
+        """
+        pairs = df[["qid", "docno", "score", "query"]].dropna().astype({"qid": str, "docno": str})
+        queries = pairs[["qid", "query"]].drop_duplicates("qid")
+        query_vectors = self._index.encode_queries(list(queries["query"]))
+        q_nos = pd.Index(queries["qid"]).get_indexer(pairs["qid"])
+        docnos = pairs["docno"].to_numpy()
+
+        # the pairs of consecutive query numbers form a batch
+        order = np.argsort(q_nos, kind="stable")
+        bounds = np.searchsorted(q_nos[order], np.arange(0, len(queries) + self.batch_size, self.batch_size))
+        ff_scores = np.full(len(pairs), np.nan)
+        num_pairs, num_ids = self.num_pairs, self.num_ids
+        for q_lo, lo, hi in zip(range(0, len(queries), self.batch_size), bounds[:-1], bounds[1:]):
+            rows = order[lo:hi]
+            if len(rows) > 0:
+                ff_scores[rows] = self._score_batch(
+                    query_vectors[q_lo: q_lo + self.batch_size], q_nos[rows] - q_lo, docnos[rows]
+                )
+        if self.num_ids > num_ids:
+            LOGGER.info(
+                "fetched %s unique IDs for %s pairs (dedup ratio %.2f)",
+                self.num_ids - num_ids,
+                self.num_pairs - num_pairs,
+                (self.num_pairs - num_pairs) / (self.num_ids - num_ids),
+            )
+
+        # like FFScore, the Fast-Forward scores have the dtype of the input ranking and pairs without vectors are dropped
+        ff_df = pairs[["qid", "docno", "query"]].assign(score=ff_scores.astype(np.float32)).dropna()
+        return df[["qid", "docno", "score"]].merge(
+            ff_df[["qid", "docno", "score", "query"]],
+            on=["qid", "docno"],
+            suffixes=["_0", None],
+        )
@@ -1,6 +1,8 @@
 import pyterrier as pt
 import pandas as pd
 
+from util.rank import descending_rank
+
 
 class InverseSquareRankInterpolate(pt.Transformer):
     """PyTerrier transformer that interpolates scores computed by `FFScore`."""
@@ -21,7 +23,7 @@ class InverseSquareRankInterpolate(pt.Transformer):
             pd.DataFrame: A new data frame with the interpolated scores.
         """
         new_df = df[["qid", "docno", "query"]].copy()
-        df['l_rank'] = df.groupby('qid')['score_0'].rank(ascending=False)
-        df['s_rank'] = df.groupby('qid')['score'].rank(ascending=False)
-        new_df["score"] = 2 * ((1/df['l_rank']**2) + (1/df['s_rank']**2))
+        l_rank = descending_rank(df, 'score_0')
+        s_rank = descending_rank(df, 'score')
+        new_df["score"] = 2 * ((1/l_rank**2) + (1/s_rank**2))
         return new_df
\ No newline at end of file
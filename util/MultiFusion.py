@@ -0,0 +1,146 @@
+from typing import List, Sequence
+
+import numpy as np
+import pandas as pd
+import pyterrier as pt
+from fast_forward.util.pyterrier import FFInterpolate
+
+from util.CombMNZInterpolate import CombMNZInterpolate
+from util.CondorcetFuseInterpolate import CondorcetFuseInterpolate, condorcet_wins
+from util.FFMinMaxInterpolate import FFMinMaxInterpolate
+from util.FFZScoreInterpolate import FFZScoreInterpolate
+from util.InverseSquareRankInterpolate import InverseSquareRankInterpolate
+from util.ReciprocalInterpolate import ReciprocalInterpolate
+from util.rank import descending_rank
+
+
+class FusionStatistics(object):
+    """Per-frame statistics shared by the rank fusion functions. Every statistic is computed at most once."""
+
+    def __init__(self, df: pd.DataFrame) -> None:
+        """Create the statistics of a data frame computed by `FFScore`.
+
+        Args:
+            df (pd.DataFrame): The PyTerrier data frame.
+        """
+        self._df = df
+        self.score_0 = df["score_0"].to_numpy(dtype=np.float64)
+        self.score = df["score"].to_numpy(dtype=np.float64)
+        self._cache = {}
+
+    def _get(self, key, compute):
+        if key not in self._cache:
+            self._cache[key] = compute()
+        return self._cache[key]
+
+    @property
+    def min_max(self):
+        """Return `(l_min, l_max, s_min, s_max)` over the whole frame."""
+        return self._get("min_max", lambda: (
+            self._df["score_0"].min(), self._df["score_0"].max(), self._df["score"].min(), self._df["score"].max()))
+
+    @property
+    def mean_std(self):
+        """Return `(l_mean, l_std, s_mean, s_std)` over the whole frame."""
+        return self._get("mean_std", lambda: (
+            self._df["score_0"].mean(), self._df["score_0"].std(), self._df["score"].mean(), self._df["score"].std()))
+
+    @property
+    def l_rank(self) -> np.ndarray:
+        """Return the rank of the lexical scores within each query."""
+        return self._get("l_rank", lambda: descending_rank(self._df, "score_0"))
+
+    @property
+    def s_rank(self) -> np.ndarray:
+        """Return the rank of the semantic scores within each query."""
+        return self._get("s_rank", lambda: descending_rank(self._df, "score"))
+
+    @property
+    def wins(self) -> np.ndarray:
+        """Return the number of Condorcet wins of each document within its query."""
+        return self._get("wins", lambda: condorcet_wins(self._df["qid"].to_numpy(), self.score_0, self.score))
+
+
+def fuse(ff_int: pt.Transformer, stats: FusionStatistics) -> np.ndarray:
+    """Compute the scores of an interpolation transformer from shared statistics.
+    The result equals the "score" column returned by the transformer, in the order of the input frame.
+
+    Args:
+        ff_int (pt.Transformer): The interpolation transformer.
+        stats (FusionStatistics): The statistics of the input frame.
+
+    Raises:
+        ValueError: When the transformer is not a supported rank fusion function.
+
+    Returns:
+        np.ndarray: The interpolated scores.
+    """
+    if isinstance(ff_int, FFMinMaxInterpolate) or isinstance(ff_int, CondorcetFuseInterpolate):
+        l_min, l_max, s_min, s_max = stats.min_max
+        scores = ff_int.alpha * ((stats.score_0 - l_min) / (l_max - l_min)) + (1 - ff_int.alpha) * (
+                (stats.score - s_min) / (s_max - s_min))
+        if isinstance(ff_int, CondorcetFuseInterpolate):
+            scores = stats.wins + np.nan_to_num(scores, nan=0.0, posinf=np.inf, neginf=-np.inf)
+        return scores
+    if isinstance(ff_int, FFZScoreInterpolate):
+        l_mean, l_std, s_mean, s_std = stats.mean_std
+        return ff_int.alpha * ((stats.score_0 - l_mean) / l_std) + (1 - ff_int.alpha) * ((stats.score - s_mean) / s_std)
+    if isinstance(ff_int, FFInterpolate):
+        return ff_int.alpha * stats.score_0 + (1 - ff_int.alpha) * stats.score
+    if isinstance(ff_int, ReciprocalInterpolate):
+        return (1 / (ff_int.alpha[0] + stats.l_rank)) + (1 / (ff_int.alpha[1] + stats.s_rank))
+    if isinstance(ff_int, InverseSquareRankInterpolate):
+        return 2 * ((1 / stats.l_rank ** 2) + (1 / stats.s_rank ** 2))
+    if isinstance(ff_int, CombMNZInterpolate):
+        return 2 * ((ff_int.num_candidates - stats.s_rank + 1) + (ff_int.num_candidates - stats.l_rank + 1))
+    raise ValueError(f"Unsupported rank fusion function {ff_int}.")
+
+
+class MultiFusion(pt.Transformer):
+    """PyTerrier transformer that computes several rank fusion functions over scores computed by `FFScore` at once.
+
+    The per-query ranks, the min-max and mean-std statistics and the Condorcet wins are computed once
+    and shared by all fusion functions.
+    """
+
+    def __init__(self, fusions: Sequence[pt.Transformer], names: Sequence[str] = None) -> None:
+        """Create a MultiFusion transformer.
+
+        Args:
+            fusions (Sequence[pt.Transformer]): The interpolation transformers to compute. Their parameters are read on every call.
+            names (Sequence[str], optional): Output column name for each fusion function. Defaults to "fusion_<i>".
+        """
+        self.fusions = list(fusions)
+        self.names = list(names) if names is not None else [f"fusion_{i}" for i in range(len(self.fusions))]
+        if len(self.names) != len(self.fusions):
+            raise ValueError("There must be exactly one name for each fusion function.")
+        super().__init__()
+
+    def transform(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Interpolate the scores for all query-document pairs in the data frame with every fusion function.
+
+        Args:
+            df (pd.DataFrame): The PyTerrier data frame.
+
+        Returns:
+            pd.DataFrame: A new data frame with one score column per fusion function.
+        """
+        stats = FusionStatistics(df)
+        new_df = df[["qid", "docno", "query"]].copy()
+        for name, ff_int in zip(self.names, self.fusions):
+            new_df[name] = fuse(ff_int, stats)
+        return new_df
+
+    def runs(self, df: pd.DataFrame) -> List[pd.DataFrame]:
+        """Interpolate the scores for all query-document pairs in the data frame with every fusion function.
+        Each result can be passed to `pt.Experiment` in place of `candidates >> ff_int`.
+
+        Args:
+            df (pd.DataFrame): The PyTerrier data frame.
+
+        Returns:
+            List[pd.DataFrame]: One new data frame with the interpolated scores per fusion function.
+        """
+        stats = FusionStatistics(df)
+        base = df[["qid", "docno", "query"]].reset_index(drop=True)
+        return [base.assign(score=fuse(ff_int, stats)) for ff_int in self.fusions]
@@ -0,0 +1,283 @@
+import itertools
+import logging
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+import torch
+from tqdm import tqdm
+from transformers import AutoTokenizer
+
+from fast_forward.encoder import Encoder
+from fast_forward.index import Index
+
+LOGGER = logging.getLogger(__name__)
+
+# the document encoder, created once per worker process
+_worker = {}
+
+
+def _init_worker(encoder_factory: Callable[[], Encoder], num_threads: int) -> None:
+    """Create the encoder in a new worker process.
+
+    Args:
+        encoder_factory (Callable[[], Encoder]): Function that creates the encoder.
+        num_threads (int): Number of torch intra-op threads of the process.
+    """
+    torch.set_num_threads(num_threads)
+    _worker["encoder"] = encoder_factory()
+
+
+def _encode(texts: List[str]) -> np.ndarray:
+    """Encode a batch of texts in a worker process.
+
+    Args:
+        texts (List[str]): The texts.
+
+    Returns:
+        np.ndarray: Their vectors.
+    """
+    return _worker["encoder"](texts)
+
+
+class TCTColBERTTokenLengths(object):
+    """Function that returns the number of tokens of each text in the input of `TCTColBERTDocumentEncoder`."""
+
+    def __init__(self, model: str, max_length: int = 512) -> None:
+        """Constructor.
+
+        Args:
+            model (str): Pre-trained model whose tokenizer to use, e.g. "castorini/tct_colbert-msmarco".
+            max_length (int, optional): Maximum number of tokens of the encoder. Defaults to 512.
+        """
+        self._tokenizer = AutoTokenizer.from_pretrained(model)
+        self._max_length = max_length
+
+    def __call__(self, texts: Sequence[str]) -> List[int]:
+        inputs = self._tokenizer(
+            ["[CLS] [D] " + text for text in texts],
+            max_length=self._max_length,
+            truncation=True,
+            add_special_tokens=False,
+        )
+        return [len(input_ids) for input_ids in inputs["input_ids"]]
+
+
+class ParallelIndexer(object):
+    """Utility class for indexing collections with several encoder processes, e.g. on machines without a GPU.
+
+    The main process reads the collection and sends batches to the workers, each of them with its own encoder. The
+    vectors are added to the index in the order of the collection, by the main process only. At most `max_pending`
+    batches are in flight, so the collection is never held in memory.
+
+    If the index supports checkpoints, like `util.disk.OnDiskIndex`, it is committed every `checkpoint_every`
+    documents, and once before indexing starts. Indexing the same collection into it again skips the documents up to
+    its watermark and drops the vectors that were added after it.
+
+    Each batch is padded to its longest document. With a `length_fn`, `bucket_window` documents are read ahead and
+    tokenized, and batches of documents with similar lengths are encoded instead. The vectors are put back into
+    corpus order before they are added to the index. `num_tokens` and `num_padded_tokens` count the tokens of the
+    documents and of the padded batches, `num_padded_tokens_unbucketed` those of batches in corpus order.
+    """
+
+    def __init__(
+            self,
+            index: Index,
+            encoder_factory: Callable[[], Encoder],
+            batch_size: int = 32,
+            num_workers: int = None,
+            num_threads: int = 1,
+            max_pending: int = None,
+            checkpoint_every: int = 2 ** 16,
+            length_fn: Callable[[Sequence[str]], Sequence[int]] = None,
+            bucket_window: int = 2 ** 12,
+    ) -> None:
+        """Constructor.
+
+        Args:
+            index (Index): The index to add the collection to.
+            encoder_factory (Callable[[], Encoder]): Picklable function that creates the document/passage encoder,
+                e.g. `functools.partial(TCTColBERTDocumentEncoder, "castorini/tct_colbert-msmarco")`.
+            batch_size (int, optional): Batch size for encoding. Defaults to 32.
+            num_workers (int, optional): Number of encoder processes. Defaults to the number of CPUs per `num_threads`.
+            num_threads (int, optional): Number of torch threads per encoder process. Defaults to 1.
+            max_pending (int, optional): Maximum number of batches in flight. Defaults to twice the number of workers.
+            checkpoint_every (int, optional): Number of documents between checkpoints. Defaults to 2**16.
+            length_fn (Callable[[Sequence[str]], Sequence[int]], optional): Function that returns the number of
+                tokens of each text, e.g. `TCTColBERTTokenLengths`. Defaults to None (no bucketing).
+            bucket_window (int, optional): Number of documents to bucket at once, ideally a multiple of `batch_size`.
+                Defaults to 2**12.
+        """
+        self._index = index
+        self._encoder_factory = encoder_factory
+        self._batch_size = batch_size
+        self._num_threads = num_threads
+        self._num_workers = num_workers or max((os.cpu_count() or 1) // num_threads, 1)
+        self._max_pending = max_pending or 2 * self._num_workers
+        self._checkpoint_every = checkpoint_every
+        self._length_fn = length_fn
+        self._bucket_window = bucket_window
+        self.num_tokens = 0
+        self.num_padded_tokens = 0
+        self.num_padded_tokens_unbucketed = 0
+
+    def padding_stats(self) -> Dict[str, float]:
+        """Return the number of tokens and the fraction of padding tokens with and without bucketing."""
+        return {
+            "tokens": self.num_tokens,
+            "padding_unbucketed": 1 - self.num_tokens / self.num_padded_tokens_unbucketed
+            if self.num_padded_tokens_unbucketed > 0 else 0.0,
+            "padding": 1 - self.num_tokens / self.num_padded_tokens if self.num_padded_tokens > 0 else 0.0,
+        }
+
+    def _read_checkpoint(self) -> int:
+        """Return the number of documents indexed at the last checkpoint, dropping any vectors added later.
+
+        Raises:
+            RuntimeError: When the index is not empty and has no checkpoint.
+
+        Returns:
+            int: The number of documents.
+        """
+        watermark = getattr(self._index, "watermark", None)
+        if watermark is None:
+            if len(self._index) > 0:
+                raise RuntimeError("The index is not empty and there is no checkpoint to resume from.")
+            # an empty checkpoint, so that a run that crashes before the first one can be resumed as well
+            self._write_checkpoint(0)
+            return 0
+
+        # the index only ignores the vectors added after the checkpoint until they are dropped
+        self._index.resume()
+        num_docs, _ = watermark
+        if num_docs > 0:
+            LOGGER.info("resuming after %s documents", num_docs)
+        return num_docs
+
+    def _write_checkpoint(self, num_docs: int) -> None:
+        """Commit the index, if it supports checkpoints.
+
+        Args:
+            num_docs (int): The number of indexed documents.
+        """
+        if hasattr(self._index, "commit"):
+            self._index.commit(num_docs)
+
+    def _windows(
+            self, data: Iterable[Dict[str, str]], size: int
+    ) -> Iterable[Tuple[List[str], List[str], List[str]]]:
+        """Group the dictionaries into windows of texts, document IDs and passage IDs."""
+        texts, doc_ids, psg_ids = [], [], []
+        for d in data:
+            texts.append(d["text"])
+            if "doc_id" in d:
+                doc_ids.append(d["doc_id"])
+            if "psg_id" in d:
+                psg_ids.append(d["psg_id"])
+
+            if len(texts) == size:
+                yield texts, doc_ids, psg_ids
+                texts, doc_ids, psg_ids = [], [], []
+
+        if len(texts) > 0:
+            yield texts, doc_ids, psg_ids
+
+    def _bucket(self, texts: List[str]) -> List[np.ndarray]:
+        """Split a window into batches of documents with similar lengths.
+
+        Args:
+            texts (List[str]): The texts of the window.
+
+        Returns:
+            List[np.ndarray]: The positions of the documents of each batch.
+        """
+        lengths = np.asarray(self._length_fn(texts), dtype=np.int64)
+        order = np.argsort(lengths, kind="stable")
+        batches = [order[i: i + self._batch_size] for i in range(0, len(texts), self._batch_size)]
+
+        self.num_tokens += int(lengths.sum())
+        self.num_padded_tokens += sum(len(batch) * int(lengths[batch].max()) for batch in batches)
+        unbucketed = np.split(lengths, range(self._batch_size, len(texts), self._batch_size))
+        self.num_padded_tokens_unbucketed += sum(len(batch) * int(batch.max()) for batch in unbucketed)
+        return batches
+
+    def index_dicts(self, data: Iterable[Dict[str, str]]) -> None:
+        """Index data from dictionaries.
+        The dictionaries should have the key "text" and at least one of "doc_id" and "psg_id".
+
+        Args:
+            data (Iterable[Dict[str, str]]): An iterable of the dictionaries, in the same order on every run. The
+                documents up to the watermark of the index are skipped without being encoded.
+        """
+        num_docs = self._read_checkpoint()
+        next_checkpoint = num_docs + self._checkpoint_every
+        start_time, start_docs = time.time(), num_docs
+
+        pending = deque()
+        progress = tqdm(initial=num_docs, unit="docs")
+
+        def write(futures: List, batches: List[np.ndarray], doc_ids: List[str], psg_ids: List[str]) -> None:
+            nonlocal num_docs, next_checkpoint
+            # restore the corpus order of the window
+            num_window_docs = sum(len(batch) for batch in batches)
+            vectors = None
+            for future, batch in zip(futures, batches):
+                if vectors is None:
+                    vectors = np.empty((num_window_docs,) + future.result().shape[1:], dtype=future.result().dtype)
+                vectors[batch] = future.result()
+
+            self._index.add(
+                vectors,
+                doc_ids=doc_ids if len(doc_ids) > 0 else None,
+                psg_ids=psg_ids if len(psg_ids) > 0 else None,
+            )
+            num_docs += num_window_docs
+            progress.update(num_window_docs)
+            if num_docs >= next_checkpoint:
+                self._write_checkpoint(num_docs)
+                next_checkpoint = num_docs + self._checkpoint_every
+                LOGGER.info(
+                    "indexed %s documents (%.1f docs/s)", num_docs, (num_docs - start_docs) / (time.time() - start_time)
+                )
+
+        # without bucketing, every window is a single batch in corpus order
+        window_size = self._batch_size if self._length_fn is None else self._bucket_window
+        # fork is not safe once torch or the JVM of PyTerrier is running
+        with ProcessPoolExecutor(
+                max_workers=self._num_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self._encoder_factory, self._num_threads),
+        ) as executor, progress:
+            num_pending = 0
+            for texts, doc_ids, psg_ids in self._windows(itertools.islice(data, num_docs, None), window_size):
+                batches = [np.arange(len(texts))] if self._length_fn is None else self._bucket(texts)
+                futures = [executor.submit(_encode, [texts[i] for i in batch]) for batch in batches]
+                pending.append((futures, batches, doc_ids, psg_ids))
+                num_pending += len(futures)
+                # the current window is always kept in flight
+                while num_pending - len(futures) >= self._max_pending:
+                    num_pending -= len(pending[0][0])
+                    write(*pending.popleft())
+            while len(pending) > 0:
+                write(*pending.popleft())
+
+        self._write_checkpoint(num_docs)
+        elapsed = time.time() - start_time
+        LOGGER.info(
+            "indexed %s documents in %.1fs (%.1f docs/s)",
+            num_docs - start_docs,
+            elapsed,
+            (num_docs - start_docs) / elapsed if elapsed > 0 else 0.0,
+        )
+        if self._length_fn is not None:
+            stats = self.padding_stats()
+            LOGGER.info(
+                "%.1f%% of the encoded tokens were padding (%.1f%% without bucketing)",
+                100 * stats["padding"],
+                100 * stats["padding_unbucketed"],
+            )
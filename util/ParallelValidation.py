@@ -0,0 +1,186 @@
+import multiprocessing
+import sys
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+from fast_forward.util.pyterrier import FFInterpolate
+
+from util.CondorcetFuseInterpolate import CondorcetFuseInterpolate
+from util.ConvexExperiment import ConvexExperiment
+from util.Evaluator import Evaluator
+from util.FFMinMaxInterpolate import FFMinMaxInterpolate
+from util.FFZScoreInterpolate import FFZScoreInterpolate
+from util.MultiFusion import FusionStatistics
+from util.ReciprocalExperiment import ReciprocalExperiment
+from util.ReciprocalInterpolate import ReciprocalInterpolate
+from util.sweep import sweep
+
+# a numpy array that lives in a shared memory block
+SharedArray = namedtuple("SharedArray", ["name", "shape", "dtype"])
+
+# the statistics and the evaluator of the candidates, attached once per worker process
+_worker = {}
+
+
+def _share(value, blocks):
+    """
+    Replace the numpy arrays in value (also inside dicts and tuples) by copies in new shared memory blocks
+    :param value: value to share
+    :param blocks: list the created blocks are added to
+    :return: value with a SharedArray for every array
+    """
+    if isinstance(value, dict):
+        return {key: _share(item, blocks) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return tuple(_share(item, blocks) for item in value)
+    if isinstance(value, np.ndarray) and value.dtype != object and value.nbytes > 0:
+        block = shared_memory.SharedMemory(create=True, size=value.nbytes)
+        blocks.append(block)
+        np.ndarray(value.shape, dtype=value.dtype, buffer=block.buf)[...] = value
+        return SharedArray(block.name, value.shape, value.dtype.str)
+    return value
+
+
+def _open_untracked(name):
+    """
+    Attach an existing shared memory block without registering it with the resource tracker. The parent owns the
+    block, a worker must neither unlink it at exit nor warn about it as leaked. Unregistering the block after attaching
+    is not an option, as spawned workers share the resource tracker of the parent and would drop its registration.
+    :param name: name of the block
+    :return: SharedMemory
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    register = resource_tracker.register
+    resource_tracker.register = lambda *args: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+def _attach(value, blocks):
+    """
+    Inverse of _share, the arrays are views of the shared memory blocks
+    :param value: value returned by _share
+    :param blocks: list the attached blocks are added to, they must stay open while the arrays are used
+    :return: value with a numpy array for every SharedArray
+    """
+    if isinstance(value, SharedArray):
+        block = _open_untracked(value.name)
+        blocks.append(block)
+        return np.ndarray(value.shape, dtype=np.dtype(value.dtype), buffer=block.buf)
+    if isinstance(value, dict):
+        return {key: _attach(item, blocks) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return tuple(_attach(item, blocks) for item in value)
+    return value
+
+
+def _init_worker(stats_state, evaluator_state):
+    """
+    Attach the shared candidates in a new worker process
+    :param stats_state: shared attributes of the FusionStatistics
+    :param evaluator_state: shared attributes of the Evaluator
+    """
+    blocks = []
+    stats = FusionStatistics.__new__(FusionStatistics)
+    stats.__dict__.update(_attach(stats_state, blocks))
+    evaluator = Evaluator.__new__(Evaluator)
+    evaluator.__dict__.update(_attach(evaluator_state, blocks))
+    _worker.update(stats=stats, evaluator=evaluator, blocks=blocks)
+
+
+def _evaluate(ff_int, setting, metrics):
+    """
+    Evaluate a single grid point in a worker process
+    :param ff_int: Interpolate transformer
+    :param setting: value of its alpha parameter
+    :param metrics: metrics to compute
+    :return: mean value of each metric
+    """
+    scores = sweep(ff_int, _worker["stats"], [setting])[:, 0]
+    results = _worker["evaluator"].evaluate(scores, metrics)
+    return {metric: float(results[metric]) for metric in metrics}
+
+
+class ParallelValidation(object):
+    """Object that runs the validation of several rank fusion functions on a pool of worker processes"""
+    # column of the result table and the metric it is validated on
+    metrics = {'MAP': 'map', 'RR': 'recip_rank', 'nDCG@10': 'ndcg_cut.10'}
+
+    def __init__(self, candidates, dataset, max_workers=None):
+        """
+        Creates the ParallelValidation object.
+        The statistics and qrels of the candidates are computed once here and handed to the workers
+        through shared memory, every job only sends its transformer and grid point.
+        :param candidates: pd.Dataframe of candidates used for the validation with their FFScore
+        :param dataset: dataset used for the validation
+        :param max_workers: number of worker processes, defaults to the number of CPUs
+        """
+        self.candidates = candidates
+        self.dataset = dataset
+        self.max_workers = max_workers
+        self.stats = FusionStatistics(candidates)
+        self.evaluator = Evaluator(candidates, dataset.get_qrels())
+
+    @staticmethod
+    def functions():
+        """
+        The rank fusion functions validated by the validation scripts
+        :return: list of (name, Interpolate transformer, grid)
+        """
+        return [
+            ('convex_identity', FFInterpolate(0.5), ConvexExperiment.grid),
+            ('convex_mm', FFMinMaxInterpolate(0.5), ConvexExperiment.grid),
+            ('convex_z', FFZScoreInterpolate(0.5), ConvexExperiment.grid),
+            ('reciprocal_identity', ReciprocalInterpolate(alpha=[10, 10]), ReciprocalExperiment.grid),
+            ('condorcet_fuse', CondorcetFuseInterpolate(0.5), ConvexExperiment.grid),
+        ]
+
+    def run(self, functions=None):
+        """
+        Validation of every (function, grid point) pair in parallel, using map, recip_rank, and nDCG@10
+        :param functions: list of (name, Interpolate transformer, grid), defaults to functions()
+        :return: one row per function with its best setting for each metric, as written by output_to_file
+        """
+        functions = self.functions() if functions is None else functions
+        metrics = list(self.metrics.values())
+
+        # compute every statistic the functions need in this process, so the workers only read them
+        for _, ff_int, grid in functions:
+            sweep(ff_int, self.stats, grid[:1])
+        stats_state = {key: value for key, value in self.stats.__dict__.items() if key != '_df'}
+
+        blocks = []
+        try:
+            stats_state = _share(stats_state, blocks)
+            evaluator_state = _share(self.evaluator.__dict__, blocks)
+            # fork is not safe once the JVM of PyTerrier is running
+            with ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                    initargs=(stats_state, evaluator_state)
+            ) as executor:
+                futures = [[executor.submit(_evaluate, ff_int, setting, metrics) for setting in grid]
+                           for _, ff_int, grid in functions]
+                results = [[future.result() for future in jobs] for jobs in futures]
+        finally:
+            for block in blocks:
+                block.close()
+                block.unlink()
+
+        res = []
+        for (name, _, grid), values in zip(functions, results):
+            row = {'function': name}
+            for column, metric in self.metrics.items():
+                # on ties the first grid point wins, like pt.GridSearch
+                best = int(np.argmax([value[metric] for value in values]))
+                print("Best %s is %f" % (metric, values[best][metric]))
+                print("Best setting is alpha=%s" % str(grid[best]))
+                row[column] = grid[best]
+            res.append(row)
+        return res
@@ -1,11 +1,15 @@
-import pyterrier as pt
-
+from util.Evaluator import Evaluator
+from util.MultiFusion import FusionStatistics
 from util.ReciprocalInterpolate import ReciprocalInterpolate
+from util.sweep import sweep, grid_search
 
 from pyterrier.measures import RR, nDCG, MAP
 
 class ReciprocalExperiment(object):
     """Object that facilitates in experiments for reciprocal rank fusion functions"""
+    grid = [[1, 1], [1, 100], [5, 10], [20, 80], [40, 60], [60, 60], [60, 40], [80, 20], [100, 1], [10, 5], [100, 100],
+            [1000, 1000]]
+
     def __init__(self, candidates, dataset, num_candidates = 100):
         """
         Creates the ReciprocalExperiment object.
@@ -16,6 +20,8 @@ class ReciprocalExperiment(object):
         self.candidates = candidates
         self.dataset = dataset
         self.num_candidates = num_candidates
+        self.stats = FusionStatistics(candidates)
+        self.evaluator = Evaluator(candidates, dataset.get_qrels())
 
     def identity_validation(self):
         """
@@ -26,37 +32,13 @@ class ReciprocalExperiment(object):
         """
         return self.validation(ReciprocalInterpolate(alpha=[10, 10]))
 
-    def validation(self, ff_int):
+    def validation(self, ff_int, metrics=("map", "recip_rank", "ndcg_cut.10")):
         """
         Validation on the ff_int using map, recip_rank, and nDCG@10
+        Every grid point is scored and evaluated once for all metrics.
         :param ff_int: Interpolate transformer used for validation
+        :param metrics: metrics to find the best alpha for
         :return: Validation result for all metric
         """
-        pt.GridSearch(
-            self.candidates >> ff_int,
-            {ff_int: {"alpha": [[1, 1], [1, 100], [5, 10], [20, 80], [40, 60], [60, 60], [60, 40], [80, 20], [100, 1], [10, 5], [100, 100], [1000, 1000]]}},
-            self.dataset.get_topics(),
-            self.dataset.get_qrels(),
-            "map",
-            verbose=True,
-        )
-        alpha_map = ff_int.alpha
-        pt.GridSearch(
-            self.candidates >> ff_int,
-            {ff_int: {"alpha": [[1, 1], [1, 100], [5, 10], [20, 80], [40, 60], [60, 60], [60, 40], [80, 20], [100, 1], [10, 5], [100, 100], [1000, 1000]]}},
-            self.dataset.get_topics(),
-            self.dataset.get_qrels(),
-            "recip_rank",
-            verbose=True,
-        )
-        alpha_RR = ff_int.alpha
-        pt.GridSearch(
-            self.candidates >> ff_int,
-            {ff_int: {"alpha": [[1, 1], [1, 100], [5, 10], [20, 80], [40, 60], [60, 60], [60, 40], [80, 20], [100, 1], [10, 5], [100, 100], [1000, 1000]]}},
-            self.dataset.get_topics(),
-            self.dataset.get_qrels(),
-            "ndcg_cut.10",
-            verbose=True,
-        )
-        alpha_nDCG = ff_int.alpha
-        return [alpha_map, alpha_RR, alpha_nDCG]
+        scores = sweep(ff_int, self.stats, self.grid)
+        return grid_search(self.evaluator, scores, self.grid, metrics)
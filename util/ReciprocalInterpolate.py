@@ -1,6 +1,8 @@
 import pyterrier as pt
 import pandas as pd
 
+from util.rank import descending_rank
+
 
 class ReciprocalInterpolate(pt.Transformer):
     """PyTerrier transformer that interpolates scores computed by `FFScore`."""
@@ -26,7 +28,7 @@ class ReciprocalInterpolate(pt.Transformer):
             pd.DataFrame: A new data frame with the interpolated scores.
         """
         new_df = df[["qid", "docno", "query"]].copy()
-        df['l_rank'] = df.groupby('qid')['score_0'].rank(ascending=False)
-        df['s_rank'] = df.groupby('qid')['score'].rank(ascending=False)
-        new_df["score"] = (1 / (self.alpha[0] + df["l_rank"])) + (1 / (self.alpha[1] + df["s_rank"]))
+        l_rank = descending_rank(df, 'score_0')
+        s_rank = descending_rank(df, 'score')
+        new_df["score"] = (1 / (self.alpha[0] + l_rank)) + (1 / (self.alpha[1] + s_rank))
         return new_df
\ No newline at end of file
@@ -1,5 +1,5 @@
 import logging
-from collections import defaultdict
+import zlib
 from pathlib import Path
 from typing import Iterable, List, Sequence, Set, Tuple, Union
 
@@ -15,13 +15,163 @@ from fast_forward.index.memory import InMemoryIndex
 LOGGER = logging.getLogger(__name__)
 
 
+def _pack_ids(ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Pack byte string IDs into a heap of their bytes.
+
+    Args:
+        ids (np.ndarray): The IDs.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The heap and the lengths of the IDs.
+    """
+    ids = np.ascontiguousarray(ids)
+    lengths = np.char.str_len(ids)
+    chars = ids.view(np.uint8).reshape(len(ids), ids.dtype.itemsize)
+    return chars[np.arange(ids.dtype.itemsize) < lengths[:, None]], lengths
+
+
+def _unpack_ids(heap: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """Inverse of `_pack_ids`, the IDs are as wide as the longest one.
+
+    Args:
+        heap (np.ndarray): The heap.
+        lengths (np.ndarray): The lengths of the IDs.
+
+    Returns:
+        np.ndarray: The IDs.
+    """
+    width = max(int(lengths.max()), 1) if len(lengths) > 0 else 1
+    chars = np.zeros((len(lengths), width), dtype=np.uint8)
+    chars[np.arange(width) < lengths[:, None]] = heap
+    return chars.view(f"S{width}").reshape(len(lengths))
+
+
+def _read_ids(fp: h5py.File, name: str, start: int, stop: int) -> np.ndarray:
+    """Read the "doc_ids" or "psg_ids" of a range of rows of an index file.
+
+    Args:
+        fp (h5py.File): The index file.
+        name (str): "doc_ids" or "psg_ids".
+        start (int): The first row.
+        stop (int): The row after the last one.
+
+    Returns:
+        np.ndarray: The IDs, empty if a row has none.
+    """
+    # indexes created before the ID heap have fixed-width IDs
+    if f"{name}_offsets" not in fp:
+        return fp[name][start:stop]
+    offsets = fp[f"{name}_offsets"][start: stop + 1]
+    return _unpack_ids(fp[f"{name}_heap"][offsets[0]: offsets[-1]], np.diff(offsets))
+
+
+def _write_ids(fp: h5py.File, name: str, start: int, ids: np.ndarray, growth_factor: float) -> None:
+    """Write the "doc_ids" or "psg_ids" of a range of rows to an index file, the rows after it are discarded.
+
+    Args:
+        fp (h5py.File): The index file.
+        name (str): "doc_ids" or "psg_ids".
+        start (int): The first row.
+        ids (np.ndarray): The IDs.
+        growth_factor (float): Factor to increase the heap size by when it is full.
+    """
+    if f"{name}_offsets" not in fp:
+        fp[name][start: start + len(ids)] = ids.astype(fp[name].dtype)
+        return
+    heap, lengths = _pack_ids(ids)
+    base = int(fp[f"{name}_offsets"][start])
+    if base + len(heap) > fp[f"{name}_heap"].shape[0]:
+        fp[f"{name}_heap"].resize(max(base + len(heap), int(fp[f"{name}_heap"].shape[0] * growth_factor)), axis=0)
+    if len(heap) > 0:
+        fp[f"{name}_heap"][base: base + len(heap)] = heap
+    fp[f"{name}_offsets"][start + 1: start + 1 + len(ids)] = base + np.cumsum(lengths)
+
+
+def _resize_rows(fp: h5py.File, num_rows: int) -> None:
+    """Resize the vector and ID datasets of an index file to a number of rows.
+
+    Args:
+        fp (h5py.File): The index file.
+        num_rows (int): The number of rows.
+    """
+    fp["vectors"].resize(num_rows, axis=0)
+    for name in ("doc_ids", "psg_ids"):
+        if f"{name}_offsets" in fp:
+            fp[f"{name}_offsets"].resize(num_rows + 1, axis=0)
+        else:
+            fp[name].resize(num_rows, axis=0)
+
+
+def _find_rows(
+        lookup: Tuple[np.ndarray, np.ndarray, np.ndarray], ids: Sequence[str], mode: Mode, warn: bool = True
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the rows of the vectors of IDs from a lookup built by `OnDiskIndex._build_lookup`, depending on the mode.
+
+    Args:
+        lookup (Tuple[np.ndarray, np.ndarray, np.ndarray]): The sorted unique IDs, the offsets of their rows and
+            the rows.
+        ids (Sequence[str]): The document or passage IDs.
+        mode (Mode): The ranking mode.
+        warn (bool, optional): Log the IDs without vectors. Defaults to True.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The rows, grouped by ID, and the offsets of the rows of every ID.
+    """
+    sorted_ids, offsets, sorted_rows = lookup
+
+    # IDs that do not fit into the dataset can not be in the index, and casting would truncate them
+    keys = [id.encode("utf-8") for id in ids]
+    fits = np.array([len(key) <= sorted_ids.dtype.itemsize for key in keys], dtype=bool)
+    keys = np.array([key if f else b"" for key, f in zip(keys, fits)], dtype=sorted_ids.dtype)
+    k = np.minimum(np.searchsorted(sorted_ids, keys), len(sorted_ids) - 1)
+    found = fits & (sorted_ids[k] == keys) if len(sorted_ids) > 0 else np.zeros(len(keys), dtype=bool)
+    lo = np.where(found, offsets[k], 0)
+    hi = np.where(found, offsets[k + 1], 0)
+    if mode == Mode.FIRSTP:
+        hi = np.minimum(hi, lo + 1)
+    elif mode == Mode.PASSAGE:
+        # like a dict, the last row of a passage ID wins
+        lo = np.maximum(lo, hi - 1)
+    counts = hi - lo
+    if warn:
+        for id in np.asarray(ids, dtype=object)[counts == 0]:
+            LOGGER.warning("no vectors for %s", id)
+
+    id_offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+    np.cumsum(counts, out=id_offsets[1:])
+    rows = sorted_rows[np.arange(id_offsets[-1]) - np.repeat(id_offsets[:-1] - lo, counts)].astype(np.int64)
+    return rows, id_offsets
+
+
 class OnDiskIndex(Index):
     """Fast-Forward index that is read on-demand from disk.
     The original code comes from https://github.com/mrjleo/fast-forward-indexes.
     This is an edited version for datasets requiring encoding.
 
-    Uses HDF5 via h5py under the hood. The buffer (ds_buffer_size) works around a h5py limitation.
+    Uses HDF5 via h5py under the hood. Vectors are read as contiguous slices rather than with fancy indexing, which
+    h5py handles one point at a time: the sorted rows are coalesced into runs, gaps of up to `max_read_gap` unused
+    rows are read as well. `bytes_read` and `bytes_used` count the vector bytes read and actually returned.
     More information: https://docs.h5py.org/en/latest/high/dataset.html#fancy-indexing
+
+    Added vectors are buffered in memory and written in large blocks aligned to the HDF5 chunks. The datasets grow
+    geometrically and are trimmed to the number of vectors by `close()`, which must be called after indexing.
+
+    `commit()` records a watermark of the indexed documents and vectors in the file, with a checksum of the last
+    committed vectors. When the index is loaded again, the checksum is verified and the vectors added after the last
+    commit, e.g. by an indexing run that crashed or is still running, are ignored. `resume()` (or adding vectors)
+    drops them from the file, so indexing can continue from the watermark.
+
+    The file stays open between calls, so the HDF5 chunk cache is kept across query batches.
+    Call `close()` or use the index as a context manager to release it.
+    More information: https://docs.h5py.org/en/stable/high/file.html#chunk-cache
+
+    The IDs are looked up in compact arrays: the sorted unique IDs and, CSR-style, the offsets of their rows.
+    They are stored in the file as well, so loading an index does not have to go through all IDs, and only
+    the mapping the mode needs (document or passage IDs) is read. Loading never modifies the file, indexes without
+    a stored lookup, e.g. created before it was stored, build it in memory unless they are loaded with `upgrade=True`.
+
+    The IDs of the rows are packed into a heap of bytes with the offsets of the rows, so IDs can have any length and
+    empty IDs take no space. Indexes with fixed-width ID datasets, created before, can still be loaded.
     """
 
     def __init__(
@@ -35,9 +185,14 @@ class OnDiskIndex(Index):
             resize_min_val: int = 2 ** 10,
             hdf5_chunk_size: int = None,
             dtype: np.dtype = np.float32,
-            max_id_length: int = 8,
             overwrite: bool = False,
             ds_buffer_size: int = 2 ** 10,
+            max_read_gap: int = 8,
+            write_buffer_size: int = 2 ** 14,
+            growth_factor: float = 2.0,
+            rdcc_nbytes: int = 2 ** 26,
+            rdcc_nslots: int = 10007,
+            rdcc_w0: float = 0.75,
     ) -> None:
         """Create an index.
 
@@ -51,9 +206,14 @@ class OnDiskIndex(Index):
             resize_min_val (int, optional): Minimum number of vectors to increase index size by. Defaults to 2**10.
             hdf5_chunk_size (int, optional): Override chunk size used by HDF5. Defaults to None.
             dtype (np.dtype, optional): Vector dtype. Defaults to np.float32.
-            max_id_length (int, optional): Maximum length of document and passage IDs (number of characters). Defaults to 8.
             overwrite (bool, optional): Overwrite index file if it exists. Defaults to False.
             ds_buffer_size (int, optional): Maximum number of vectors to retrieve from the HDF5 dataset at once. Defaults to 2**10.
+            max_read_gap (int, optional): Maximum number of unused vectors read to merge two reads. Defaults to 8.
+            write_buffer_size (int, optional): Number of added vectors buffered before they are written. Defaults to 2**14.
+            growth_factor (float, optional): Factor to increase the index size by when it is full. Defaults to 2.0.
+            rdcc_nbytes (int, optional): Size of the HDF5 raw data chunk cache in bytes. Defaults to 2**26.
+            rdcc_nslots (int, optional): Number of hash table slots of the chunk cache, ideally a prime. Defaults to 10007.
+            rdcc_w0 (float, optional): Preemption policy of the chunk cache, 1 evicts fully read chunks first. Defaults to 0.75.
 
         Raises:
             ValueError: When the file exists and `overwrite=False`.
@@ -65,200 +225,489 @@ class OnDiskIndex(Index):
         self._index_file = index_file.absolute()
         self._resize_min_val = resize_min_val
         self._ds_buffer_size = ds_buffer_size
-        self._doc_id_to_idx = defaultdict(list)
-        self._psg_id_to_idx = {}
-
-        with h5py.File(self._index_file, "w") as fp:
-            fp.attrs["num_vectors"] = 0
-            fp.attrs["ff_version"] = fast_forward.__version__
-            fp.create_dataset(
-                "vectors",
-                (init_size, dim),
-                dtype,
-                maxshape=(None, dim),
-                chunks=True if hdf5_chunk_size is None else (hdf5_chunk_size, dim),
-            )
-            fp.create_dataset(
-                "doc_ids",
-                (init_size,),
-                f"S{max_id_length}",
+        self._max_read_gap = max_read_gap
+        self._write_buffer_size = write_buffer_size
+        self._growth_factor = growth_factor
+        self._write_buffer = []
+        self._num_buffered = 0
+        self.bytes_read = 0
+        self.bytes_used = 0
+        self._lookup = {}
+        self._id_sets = {}
+        self._cache_args = {"rdcc_nbytes": rdcc_nbytes, "rdcc_nslots": rdcc_nslots, "rdcc_w0": rdcc_w0}
+        self._num_vectors = 0
+        self._dim = dim
+
+        # the file stays open for writing, it is flushed after every block of vectors
+        self._fp = h5py.File(self._index_file, "w", **self._cache_args)
+        self._fp.attrs["num_vectors"] = 0
+        self._fp.attrs["ff_version"] = fast_forward.__version__
+        self._fp.create_dataset(
+            "vectors",
+            (init_size, dim),
+            dtype,
+            maxshape=(None, dim),
+            chunks=True if hdf5_chunk_size is None else (hdf5_chunk_size, dim),
+        )
+        for name in ("doc_ids", "psg_ids"):
+            self._fp.create_dataset(f"{name}_heap", (0,), np.uint8, maxshape=(None,), chunks=True)
+            self._fp.create_dataset(
+                f"{name}_offsets",
+                (init_size + 1,),
+                np.int64,
                 maxshape=(None,),
                 chunks=True if hdf5_chunk_size is None else (hdf5_chunk_size,),
             )
-            fp.create_dataset(
-                "psg_ids",
-                (init_size,),
-                f"S{max_id_length}",
-                maxshape=(None,),
-                chunks=True if hdf5_chunk_size is None else (hdf5_chunk_size,),
+        self._fp.flush()
+
+    def _file(self, writable: bool = False) -> h5py.File:
+        """Return the open index file, (re)opening it if necessary.
+
+        Args:
+            writable (bool, optional): Whether the file is going to be modified. Defaults to False.
+
+        Returns:
+            h5py.File: The index file.
+        """
+        if self._fp is None or (writable and self._fp.mode != "r+"):
+            if self._fp is not None:
+                self._fp.close()
+            self._fp = h5py.File(self._index_file, "a" if writable else "r", **self._cache_args)
+        return self._fp
+
+    def close(self) -> None:
+        """Close the index file. If vectors were added, the buffered ones are written, the datasets are trimmed to
+        the number of vectors and the ID lookup is stored. The file is opened again when the index is used.
+        """
+        self._flush_writes()
+        if self._fp is not None:
+            if self._fp.mode == "r+":
+                if self._fp["vectors"].shape[0] > self._num_vectors:
+                    _resize_rows(self._fp, self._num_vectors)
+                for name in ("doc_ids", "psg_ids"):
+                    if f"{name}_offsets" in self._fp:
+                        self._fp[f"{name}_heap"].resize(self._fp[f"{name}_offsets"][self._num_vectors], axis=0)
+                if not self._has_stored_lookup():
+                    self._store_lookup()
+            self._fp.close()
+            self._fp = None
+
+    def flush(self) -> None:
+        """Write all buffered vectors to the index file."""
+        self._flush_writes()
+
+    def truncate(self, num_vectors: int) -> None:
+        """Remove all vectors after the first ones, e.g. those added after the last checkpoint.
+
+        Args:
+            num_vectors (int): The number of vectors to keep.
+        """
+        self._flush_writes()
+        if num_vectors >= self._num_vectors:
+            return
+        fp = self._file(writable=True)
+        fp.attrs["num_vectors"] = num_vectors
+        # the stored lookup might have been built for the same number of vectors
+        if "lookup_num_vectors" in fp.attrs:
+            del fp.attrs["lookup_num_vectors"]
+        if self.watermark is not None and self.watermark[1] > num_vectors:
+            for name in ("committed_num_docs", "committed_num_vectors", "committed_tail_crc32"):
+                del fp.attrs[name]
+        self._num_vectors = num_vectors
+        self._lookup, self._id_sets = {}, {}
+        fp.flush()
+
+    @property
+    def watermark(self) -> Union[Tuple[int, int], None]:
+        """Return the number of documents and vectors at the last commit, None if the index was never committed."""
+        fp = self._file()
+        if "committed_num_vectors" not in fp.attrs:
+            return None
+        return int(fp.attrs["committed_num_docs"]), int(fp.attrs["committed_num_vectors"])
+
+    def _tail_checksum(self, num_vectors: int, tail_size: int = 64) -> int:
+        """Compute the checksum of the last vectors and IDs before a position.
+
+        Args:
+            num_vectors (int): The position.
+            tail_size (int, optional): The number of vectors to include. Defaults to 64.
+
+        Returns:
+            int: The CRC-32 checksum.
+        """
+        fp = self._file()
+        tail = np.s_[max(num_vectors - tail_size, 0): num_vectors]
+        checksum = zlib.crc32(np.ascontiguousarray(fp["vectors"][tail]).tobytes())
+        for name in ("doc_ids", "psg_ids"):
+            checksum = zlib.crc32(_read_ids(fp, name, tail.start, tail.stop).tobytes(), checksum)
+        return checksum
+
+    def commit(self, num_docs: int) -> None:
+        """Write all buffered vectors and record the watermark of the index in the file.
+
+        Args:
+            num_docs (int): The number of documents indexed so far.
+        """
+        self._flush_writes()
+        fp = self._file(writable=True)
+        fp.attrs["committed_tail_crc32"] = self._tail_checksum(self._num_vectors)
+        fp.attrs["committed_num_vectors"] = self._num_vectors
+        fp.attrs["committed_num_docs"] = num_docs
+        fp.flush()
+
+    def _verify_tail(self) -> None:
+        """Verify the last committed vectors.
+
+        Raises:
+            RuntimeError: When committed vectors are missing or corrupt.
+        """
+        if self.watermark is None:
+            return
+        _, num_vectors = self.watermark
+        if int(self._file().attrs["num_vectors"]) < num_vectors:
+            raise RuntimeError(
+                f"The index has {self._file().attrs['num_vectors']} vectors, but {num_vectors} were committed."
             )
+        if self._tail_checksum(num_vectors) != int(self._file().attrs["committed_tail_crc32"]):
+            raise RuntimeError(f"The last committed vectors of {self._index_file} are corrupt.")
+
+    def resume(self) -> None:
+        """Drop the vectors that were added to the file after the last commit, e.g. by an indexing run that crashed,
+        to continue indexing from the watermark. A loaded index only ignores them, so that readers never modify an
+        index that is still being written.
+        """
+        if self.watermark is None:
+            return
+        num_vectors = int(self._file().attrs["num_vectors"])
+        if num_vectors > self.watermark[1]:
+            LOGGER.warning("dropping %s vectors added after the last commit", num_vectors - self.watermark[1])
+            self._num_vectors = num_vectors
+            self.truncate(self.watermark[1])
+
+    def __enter__(self) -> "OnDiskIndex":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
 
     def __len__(self) -> int:
-        with h5py.File(self._index_file, "r") as fp:
-            return fp.attrs["num_vectors"]
+        return self._num_vectors + self._num_buffered
+
+    @staticmethod
+    def _build_lookup(ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Dictionary-encode the non-empty IDs of the rows.
+
+        Args:
+            ids (np.ndarray): The (byte string) ID of every row.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, np.ndarray]: The sorted unique IDs, the offsets of their rows and the rows,
+                the rows of the i-th ID are `rows[offsets[i]:offsets[i + 1]]` in ascending order.
+        """
+        index_dtype = np.int32 if len(ids) < 2 ** 31 else np.int64
+        rows = np.flatnonzero(ids != b"")
+        order = np.argsort(ids[rows], kind="stable")
+        sorted_ids = ids[rows][order]
+        new_id = np.ones(len(sorted_ids), dtype=bool)
+        new_id[1:] = sorted_ids[1:] != sorted_ids[:-1]
+        starts = np.flatnonzero(new_id)
+        return (
+            sorted_ids[starts],
+            np.append(starts, len(sorted_ids)).astype(index_dtype),
+            rows[order].astype(index_dtype),
+        )
+
+    def _has_stored_lookup(self) -> bool:
+        fp = self._file()
+        return "sorted_doc_ids_offsets" in fp and fp.attrs.get("lookup_num_vectors", -1) == self._num_vectors
+
+    def _get_lookup(self, name: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Return the sorted unique IDs, the offsets of their rows and the rows for "doc_ids" or "psg_ids".
+        They are read from the file if they are stored there and up to date, otherwise they are computed.
+
+        Args:
+            name (str): "doc_ids" or "psg_ids".
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, np.ndarray]: The lookup arrays.
+        """
+        self._flush_writes()
+        if name not in self._lookup:
+            fp = self._file()
+            if self._has_stored_lookup():
+                self._lookup[name] = tuple(
+                    fp[ds][:] for ds in (f"sorted_{name}", f"sorted_{name}_offsets", f"sorted_{name}_rows")
+                )
+                # with the ID heap, the unique IDs are packed as well
+                if f"sorted_{name}_lengths" in fp:
+                    self._lookup[name] = (
+                        _unpack_ids(self._lookup[name][0], fp[f"sorted_{name}_lengths"][:]),
+                    ) + self._lookup[name][1:]
+            else:
+                self._lookup[name] = self._build_lookup(_read_ids(fp, name, 0, self._num_vectors))
+        return self._lookup[name]
+
+    def _store_lookup(self) -> None:
+        """Store the lookup arrays of the document and passage IDs in the index file."""
+        lookups = {name: self._get_lookup(name) for name in ("doc_ids", "psg_ids")}
+        fp = self._file(writable=True)
+        for name, (sorted_ids, offsets, rows) in lookups.items():
+            datasets = {f"sorted_{name}_offsets": offsets, f"sorted_{name}_rows": rows}
+            if f"{name}_offsets" in fp:
+                datasets[f"sorted_{name}"], lengths = _pack_ids(sorted_ids)
+                datasets[f"sorted_{name}_lengths"] = lengths.astype(np.int32)
+            else:
+                datasets[f"sorted_{name}"] = sorted_ids.astype(fp[name].dtype)
+            for ds, data in datasets.items():
+                if ds in fp:
+                    del fp[ds]
+                fp.create_dataset(ds, data=data)
+        fp.attrs["lookup_num_vectors"] = self._num_vectors
+        fp.flush()
 
     @property
     def dim(self) -> int:
-        with h5py.File(self._index_file, "r") as fp:
-            return fp["vectors"].shape[1]
+        return self._dim
+
+    def _decode(self, vectors: np.ndarray) -> np.ndarray:
+        """Convert rows of the vectors dataset into vectors. `OnDiskIndex` stores the vectors as they are, subclasses
+        may store compressed codes instead.
 
-    def to_memory(self, buffer_size=None) -> InMemoryIndex:
+        Args:
+            vectors (np.ndarray): The rows.
+
+        Returns:
+            np.ndarray: The vectors.
+        """
+        return vectors
+
+    def to_memory(self, buffer_size: int = 2 ** 16) -> InMemoryIndex:
         """Load the index entirely into memory.
+        The vectors are streamed in chunks into the preallocated index, so only one chunk is held in addition to it.
 
         Args:
-            buffer_size (int, optional): Use a buffer instead of adding all vectors at once. Defaults to None.
+            buffer_size (int, optional): Number of vectors to read at once, None reads all vectors at once. Defaults to 2**16.
 
         Returns:
             InMemoryIndex: The loaded index.
         """
-        with h5py.File(self._index_file, "r") as fp:
-            index = InMemoryIndex(
-                dim=self.dim,
-                query_encoder=self._query_encoder,
-                mode=self.mode,
-                encoder_batch_size=self._encoder_batch_size,
-                init_size=len(self),
-                dtype=fp["vectors"].dtype,
-            )
-
-            buffer_size = buffer_size or fp.attrs["num_vectors"]
-            for i_low in range(0, fp.attrs["num_vectors"], buffer_size):
-                i_up = min(i_low + buffer_size, fp.attrs["num_vectors"])
+        self._flush_writes()
+        fp = self._file()
+        num_vectors = len(self)
+        buffer_size = max(min(buffer_size or num_vectors, num_vectors), 1)
+        buffer = np.empty((buffer_size, fp["vectors"].shape[1]), dtype=fp["vectors"].dtype)
+        index = InMemoryIndex(
+            dim=self.dim,
+            query_encoder=self._query_encoder,
+            mode=self.mode,
+            encoder_batch_size=self._encoder_batch_size,
+            init_size=len(self),
+            dtype=self._decode(buffer[:0]).dtype,
+        )
+
+        with tqdm(total=num_vectors, unit="vectors", unit_scale=True, desc="loading index") as progress:
+            for i_low in range(0, num_vectors, buffer_size):
+                i_up = min(i_low + buffer_size, num_vectors)
+                vecs = buffer[: i_up - i_low]
+                fp["vectors"].read_direct(vecs, np.s_[i_low:i_up])
+                doc_ids = _read_ids(fp, "doc_ids", i_low, i_up)
+                psg_ids = _read_ids(fp, "psg_ids", i_low, i_up)
 
                 # we can only add vectors of the same type (doc IDs, passage IDs, or both) in one batch
-                has_doc_id, has_psg_id, has_both_ids = [], [], []
-                vecs = fp["vectors"][i_low:i_up]
-                try:
-                    doc_ids = fp["doc_ids"].asstr()[i_low:i_up]
-                    psg_ids = fp["psg_ids"].asstr()[i_low:i_up]
-                except Exception as e:
-                    doc_ids = fp["doc_ids"].asstr(encoding="utf-8")[i_low:i_up]
-                    psg_ids = fp["psg_ids"].asstr(encoding="utf-8")[i_low:i_up]
-
-                for j, (doc_id, psg_id) in enumerate(zip(doc_ids, psg_ids)):
-                    if len(doc_id) == 0:
-                        has_psg_id.append(j)
-                    elif len(psg_id) == 0:
-                        has_doc_id.append(j)
-                    else:
-                        has_both_ids.append(j)
-
-                if len(has_doc_id) > 0:
-                    index.add(
-                        vecs[has_doc_id],
-                        doc_ids=doc_ids[has_doc_id],
-                    )
-                if len(has_psg_id) > 0:
-                    index.add(
-                        vecs[has_psg_id],
-                        psg_ids=psg_ids[has_psg_id],
-                    )
-                if len(has_both_ids) > 0:
-                    index.add(
-                        vecs[has_both_ids],
-                        doc_ids=doc_ids[has_both_ids],
-                        psg_ids=psg_ids[has_both_ids],
-                    )
+                has_doc_id = doc_ids != b""
+                has_psg_id = psg_ids != b""
+                for mask, ids in (
+                        (has_doc_id & ~has_psg_id, {"doc_ids": doc_ids}),
+                        (~has_doc_id, {"psg_ids": psg_ids}),
+                        (has_doc_id & has_psg_id, {"doc_ids": doc_ids, "psg_ids": psg_ids}),
+                ):
+                    if mask.any():
+                        index.add(
+                            self._decode(vecs[mask]),
+                            **{key: np.char.decode(value[mask], "utf-8").tolist() for key, value in ids.items()},
+                        )
+                progress.update(i_up - i_low)
         return index
 
+    @staticmethod
+    def _encode_ids(
+            ids: Union[Sequence[str], None], num_vectors: int, max_length: Union[int, None], kind: str
+    ) -> np.ndarray:
+        """Encode IDs as UTF-8 byte strings, checking their length.
+
+        Args:
+            ids (Union[Sequence[str], None]): The IDs, None for no IDs.
+            num_vectors (int): The number of vectors.
+            max_length (Union[int, None]): The maximum length of an ID in bytes, None for no maximum.
+            kind (str): "Document" or "Passage", for the error message.
+
+        Raises:
+            RuntimeError: When an ID is longer than the maximum.
+
+        Returns:
+            np.ndarray: The IDs, empty if there are none.
+        """
+        if ids is None:
+            return np.full(num_vectors, b"", dtype="S1")
+        encoded = np.char.encode(np.asarray(ids, dtype=str), "utf-8").reshape(num_vectors)
+        if max_length is not None and encoded.dtype.itemsize > max_length:
+            too_long = int(np.argmax(np.char.str_len(encoded) > max_length))
+            raise RuntimeError(f"{kind} ID {ids[too_long]} is longer than the maximum ({max_length} bytes).")
+        return encoded
+
     def _add(
             self,
             vectors: np.ndarray,
             doc_ids: Union[Sequence[str], None],
             psg_ids: Union[Sequence[str], None],
     ) -> None:
-        with h5py.File(self._index_file, "a") as fp:
-            num_new_vecs = vectors.shape[0]
-            capacity = fp["vectors"].shape[0]
-
-            # check if we have enough space, resize if necessary
-            cur_num_vectors = fp.attrs["num_vectors"]
-            space_left = capacity - cur_num_vectors
-            if num_new_vecs > space_left:
-                new_size = max(
-                    capacity + num_new_vecs - space_left, self._resize_min_val
-                )
-                LOGGER.debug("resizing index from %s to %s", capacity, new_size)
-                fp["vectors"].resize(new_size, axis=0)
-                fp["doc_ids"].resize(new_size, axis=0)
-                fp["psg_ids"].resize(new_size, axis=0)
-
-            # check all IDs first before adding anything
-            doc_id_size = fp["doc_ids"].dtype.itemsize
-            psg_id_size = fp["psg_ids"].dtype.itemsize
-            add_doc_ids, add_psg_ids = [], []
-            if doc_ids is not None:
-                for i, doc_id in enumerate(doc_ids):
-                    if len(doc_id) > doc_id_size:
-                        raise RuntimeError(
-                            f"Document ID {doc_id} is longer than the maximum ({doc_id_size} characters)."
-                        )
-                    add_doc_ids.append((doc_id, cur_num_vectors + i))
-            if psg_ids is not None:
-                for i, psg_id in enumerate(psg_ids):
-                    if len(psg_id) > psg_id_size:
-                        raise RuntimeError(
-                            f"Passage ID {psg_id} is longer than the maximum ({psg_id_size} characters)."
-                        )
-                    add_psg_ids.append((psg_id, cur_num_vectors + i))
-
-            # add new IDs to index and in-memory mappings
-            if doc_ids is not None:
-                for doc_id, idx in add_doc_ids:
-                    self._doc_id_to_idx[doc_id].append(idx)
-                fp["doc_ids"][
-                cur_num_vectors: cur_num_vectors + num_new_vecs
-                ] = doc_ids
-            if psg_ids is not None:
-                for psg_id, idx in add_psg_ids:
-                    self._psg_id_to_idx[psg_id] = idx
-                fp["psg_ids"][
-                cur_num_vectors: cur_num_vectors + num_new_vecs
-                ] = psg_ids
-
-            # add new vectors
-            fp["vectors"][cur_num_vectors: cur_num_vectors + num_new_vecs] = vectors
-            fp.attrs["num_vectors"] += num_new_vecs
+        # check all IDs first before adding anything, only fixed-width IDs have a maximum length
+        fp = self._file()
+        if int(fp.attrs["num_vectors"]) > self._num_vectors:
+            # the vectors after the watermark are overwritten
+            self.resume()
+            fp = self._file()
+        max_lengths = {
+            name: None if f"{name}_offsets" in fp else fp[name].dtype.itemsize for name in ("doc_ids", "psg_ids")
+        }
+        doc_ids = self._encode_ids(doc_ids, vectors.shape[0], max_lengths["doc_ids"], "Document")
+        psg_ids = self._encode_ids(psg_ids, vectors.shape[0], max_lengths["psg_ids"], "Passage")
+
+        # the lookup is built again when it is needed
+        self._lookup, self._id_sets = {}, {}
+        self._write_buffer.append((vectors, doc_ids, psg_ids))
+        self._num_buffered += vectors.shape[0]
+        if self._num_buffered >= self._write_buffer_size:
+            self._flush_writes(aligned=True)
+
+    def _flush_writes(self, aligned: bool = False) -> None:
+        """Write the buffered vectors and IDs to the index file, resizing the datasets if necessary.
+
+        Args:
+            aligned (bool, optional): Only write up to the last complete HDF5 chunk and keep the rest buffered. Defaults to False.
+        """
+        if self._num_buffered == 0:
+            return
+        fp = self._file(writable=True)
+        vectors = np.concatenate([v for v, _, _ in self._write_buffer])
+        doc_ids = np.concatenate([d for _, d, _ in self._write_buffer])
+        psg_ids = np.concatenate([p for _, _, p in self._write_buffer])
+
+        cur_num_vectors = self._num_vectors
+        num_new_vecs = vectors.shape[0]
+        if aligned and fp["vectors"].chunks is not None:
+            chunk_size = fp["vectors"].chunks[0]
+            num_new_vecs = (cur_num_vectors + num_new_vecs) // chunk_size * chunk_size - cur_num_vectors
+            if num_new_vecs <= 0:
+                return
+
+        # check if we have enough space, grow geometrically if necessary
+        capacity = fp["vectors"].shape[0]
+        if cur_num_vectors + num_new_vecs > capacity:
+            new_size = max(
+                cur_num_vectors + num_new_vecs, int(capacity * self._growth_factor), capacity + self._resize_min_val
+            )
+            LOGGER.debug("resizing index from %s to %s", capacity, new_size)
+            _resize_rows(fp, new_size)
+
+        _write_ids(fp, "doc_ids", cur_num_vectors, doc_ids[:num_new_vecs], self._growth_factor)
+        _write_ids(fp, "psg_ids", cur_num_vectors, psg_ids[:num_new_vecs], self._growth_factor)
+        fp["vectors"][cur_num_vectors: cur_num_vectors + num_new_vecs] = vectors[:num_new_vecs]
+        fp.attrs["num_vectors"] = cur_num_vectors + num_new_vecs
+        self._num_vectors = cur_num_vectors + num_new_vecs
+        fp.flush()
+
+        self._write_buffer = []
+        self._num_buffered = vectors.shape[0] - num_new_vecs
+        if self._num_buffered > 0:
+            self._write_buffer.append((vectors[num_new_vecs:], doc_ids[num_new_vecs:], psg_ids[num_new_vecs:]))
+
+    def _get_id_set(self, name: str) -> Set[str]:
+        if name not in self._id_sets:
+            self._id_sets[name] = {id.decode("utf-8") for id in self._get_lookup(name)[0]}
+        return self._id_sets[name]
 
     def _get_doc_ids(self) -> Set[str]:
-        return set(self._doc_id_to_idx.keys())
+        return self._get_id_set("doc_ids")
 
     def _get_psg_ids(self) -> Set[str]:
-        return set(self._psg_id_to_idx.keys())
+        return self._get_id_set("psg_ids")
+
+    def _lookup_rows(self, ids: Sequence[str], warn: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the rows of the vectors of IDs, depending on the mode.
+
+        Args:
+            ids (Sequence[str]): The document or passage IDs.
+            warn (bool, optional): Log the IDs without vectors. Defaults to True.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The rows, grouped by ID, and the offsets of the rows of every ID.
+        """
+        return _find_rows(
+            self._get_lookup("psg_ids" if self.mode == Mode.PASSAGE else "doc_ids"), ids, self.mode, warn
+        )
 
     def _get_vectors(self, ids: Iterable[str]) -> Tuple[np.ndarray, List[List[int]]]:
-        idx_pairs = []
-        with h5py.File(self._index_file, "r") as fp:
-            for id in ids:
-                if self.mode in (Mode.MAXP, Mode.AVEP) and id in self._doc_id_to_idx:
-                    idxs = self._doc_id_to_idx[id]
-                elif self.mode == Mode.FIRSTP and id in self._doc_id_to_idx:
-                    idxs = [self._doc_id_to_idx[id][0]]
-                elif self.mode == Mode.PASSAGE and id in self._psg_id_to_idx:
-                    idxs = [self._psg_id_to_idx[id]]
-                else:
-                    LOGGER.warning("no vectors for %s", id)
-                    idxs = []
-
-                for idx in idxs:
-                    idx_pairs.append((id, idx))
-
-            # h5py requires accessing the dataset with sorted indices
-            idx_pairs.sort(key=lambda x: x[1])
-            id_to_idxs = defaultdict(list)
-            vec_idxs = []
-            for id_idx, (id, vec_idx) in enumerate(idx_pairs):
-                vec_idxs.append(vec_idx)
-                id_to_idxs[id].append(id_idx)
-
-            # reading all vectors at once slows h5py down significantly, so we read them in chunks and concatenate
-            vectors = np.concatenate(
-                [
-                    fp["vectors"][vec_idxs[i: i + self._ds_buffer_size]]
-                    for i in range(0, len(vec_idxs), self._ds_buffer_size)
-                ]
-            )
-            return vectors, [id_to_idxs[id] for id in ids]
+        rows, id_offsets = self._lookup_rows(list(ids))
+
+        # read the rows in ascending order
+        order = np.argsort(rows, kind="stable")
+        positions = np.empty(len(order), dtype=np.int64)
+        positions[order] = np.arange(len(order))
+        vectors = self._read_rows(rows[order])
+        return vectors, [positions[f:t].tolist() for f, t in zip(id_offsets[:-1], id_offsets[1:])]
+
+    def _get_vectors_csr(self, ids: Iterable[str], warn: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+        """Like `_get_vectors`, but the vectors are grouped by ID, CSR-style, instead of mapped by lists.
+
+        Args:
+            ids (Iterable[str]): The document or passage IDs.
+            warn (bool, optional): Log the IDs without vectors. Defaults to True.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The vectors and the offsets of the vectors of every ID.
+        """
+        rows, id_offsets = self._lookup_rows(list(ids), warn)
+
+        # read the rows in ascending order and put them back in the order of the IDs
+        order = np.argsort(rows, kind="stable")
+        stored = self._read_rows(rows[order])
+        vectors = np.empty_like(stored)
+        vectors[order] = stored
+        return vectors, id_offsets
+
+    def _read_rows(self, rows: np.ndarray) -> np.ndarray:
+        """Read vectors with as few slices as possible.
+        The rows are coalesced into runs, gaps of at most `max_read_gap` rows within a run are read and dropped.
+        Runs are read into one buffer, in pieces of at most `ds_buffer_size` rows, and the requested rows are taken from it.
+
+        Args:
+            rows (np.ndarray): The rows to read, in ascending order.
+
+        Returns:
+            np.ndarray: The vectors of the rows.
+        """
+        self._flush_writes()
+        ds = self._file()["vectors"]
+        if len(rows) == 0:
+            return np.zeros((0, ds.shape[1]), dtype=ds.dtype)
+
+        new_run = np.ones(len(rows), dtype=bool)
+        new_run[1:] = rows[1:] - rows[:-1] - 1 > self._max_read_gap
+        run_of_row = np.cumsum(new_run) - 1
+        run_starts = rows[new_run]
+        run_ends = rows[np.append(np.flatnonzero(new_run)[1:] - 1, len(rows) - 1)] + 1
+        buffer_offsets = np.cumsum(run_ends - run_starts) - (run_ends - run_starts)
+
+        buffer = np.empty(((run_ends - run_starts).sum(), ds.shape[1]), dtype=ds.dtype)
+        for start, end, offset in zip(run_starts, run_ends, buffer_offsets):
+            for i_low in range(start, end, self._ds_buffer_size):
+                i_up = min(i_low + self._ds_buffer_size, end)
+                ds.read_direct(buffer, np.s_[i_low:i_up], np.s_[offset + i_low - start: offset + i_up - start])
+
+        self.bytes_read += buffer.nbytes
+        self.bytes_used += len(rows) * buffer.itemsize * ds.shape[1]
+        return buffer[buffer_offsets[run_of_row] + rows - run_starts[run_of_row]]
 
     @classmethod
     def load(
@@ -269,6 +718,14 @@ class OnDiskIndex(Index):
             encoder_batch_size: int = 32,
             resize_min_val: int = 2 ** 10,
             ds_buffer_size: int = 2 ** 10,
+            max_read_gap: int = 8,
+            write_buffer_size: int = 2 ** 14,
+            growth_factor: float = 2.0,
+            rdcc_nbytes: int = 2 ** 26,
+            rdcc_nslots: int = 10007,
+            rdcc_w0: float = 0.75,
+            upgrade: bool = False,
+            resume: bool = False,
     ) -> "OnDiskIndex":
         """Open an existing index on disk.
 
@@ -279,6 +736,15 @@ class OnDiskIndex(Index):
             encoder_batch_size (int, optional): Batch size for query encoder. Defaults to 32.
             resize_min_val (int, optional): Minimum number of vectors to increase index size by. Defaults to 2**10.
             ds_buffer_size (int, optional): Maximum number of vectors to retrieve from the HDF5 dataset at once. Defaults to 2**10.
+            max_read_gap (int, optional): Maximum number of unused vectors read to merge two reads. Defaults to 8.
+            write_buffer_size (int, optional): Number of added vectors buffered before they are written. Defaults to 2**14.
+            growth_factor (float, optional): Factor to increase the index size by when it is full. Defaults to 2.0.
+            rdcc_nbytes (int, optional): Size of the HDF5 raw data chunk cache in bytes. Defaults to 2**26.
+            rdcc_nslots (int, optional): Number of hash table slots of the chunk cache, ideally a prime. Defaults to 10007.
+            rdcc_w0 (float, optional): Preemption policy of the chunk cache, 1 evicts fully read chunks first. Defaults to 0.75.
+            upgrade (bool, optional): Store the ID lookup in the file if it is missing or outdated. Defaults to False.
+            resume (bool, optional): Drop the vectors added after the last commit from the file, see `resume()`.
+                Defaults to False (they are ignored).
 
         Returns:
             OnDiskIndex: The index.
@@ -288,29 +754,29 @@ class OnDiskIndex(Index):
         index._index_file = index_file.absolute()
         index._resize_min_val = resize_min_val
         index._ds_buffer_size = ds_buffer_size
-
-        # read ID mappings
-        index._doc_id_to_idx = defaultdict(list)
-        index._psg_id_to_idx = {}
-        with h5py.File(index._index_file, "r") as fp:
-            try:
-                doc_ids = fp["doc_ids"].asstr()[: fp.attrs["num_vectors"]]
-                psg_ids = fp["psg_ids"].asstr()[: fp.attrs["num_vectors"]]
-            except Exception as e:
-                doc_ids = fp["doc_ids"].asstr(encoding="utf-8")[: fp.attrs["num_vectors"]]
-                psg_ids = fp["psg_ids"].asstr(encoding="utf-8")[: fp.attrs["num_vectors"]]
-
-            for i, (doc_id, psg_id) in tqdm(
-                    enumerate(
-                        zip(
-                            doc_ids,
-                            psg_ids,
-                        ),
-                    ),
-                    total=fp.attrs["num_vectors"],
-            ):
-                if len(doc_id) > 0:
-                    index._doc_id_to_idx[doc_id].append(i)
-                if len(psg_id) > 0:
-                    index._psg_id_to_idx[psg_id] = i
+        index._max_read_gap = max_read_gap
+        index._write_buffer_size = write_buffer_size
+        index._growth_factor = growth_factor
+        index._write_buffer = []
+        index._num_buffered = 0
+        index.bytes_read = 0
+        index.bytes_used = 0
+
+        index._cache_args = {"rdcc_nbytes": rdcc_nbytes, "rdcc_nslots": rdcc_nslots, "rdcc_w0": rdcc_w0}
+        index._fp = None
+        fp = index._file()
+        index._num_vectors = int(fp.attrs["num_vectors"])
+        index._dim = fp["vectors"].shape[1]
+        index._lookup = {}
+        index._id_sets = {}
+        index._verify_tail()
+        if resume:
+            index.resume()
+        elif index.watermark is not None:
+            index._num_vectors = index.watermark[1]
+
+        if upgrade and not index._has_stored_lookup():
+            LOGGER.info("storing ID lookup in %s", index._index_file)
+            index._store_lookup()
+            index.close()
         return index
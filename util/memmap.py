@@ -0,0 +1,141 @@
+import logging
+from pathlib import Path
+from typing import Iterable, List, Sequence, Set, Tuple, Union
+
+import h5py
+import numpy as np
+from tqdm import tqdm
+
+from fast_forward.encoder import Encoder
+from fast_forward.index import Index, Mode
+
+from util.disk import OnDiskIndex, _find_rows, _read_ids
+from util.sharded import _committed_size
+
+LOGGER = logging.getLogger(__name__)
+
+
+def convert_hdf5(index_file: Path, index_dir: Path, buffer_size: int = 2 ** 16, overwrite: bool = False) -> None:
+    """Convert an HDF5 index created by `OnDiskIndex` into the files of a `MemmapIndex`.
+    The vectors and IDs are copied in chunks, so the index never has to fit into memory. The ID lookups are built
+    once and stored as well, so opening the index does not have to go through the IDs. Vectors added after the last
+    commit of the index are not converted.
+
+    Args:
+        index_file (Path): The HDF5 index file, e.g. "ffindex_fiqa_tct.h5".
+        index_dir (Path): Directory to create the `MemmapIndex` files in.
+        buffer_size (int, optional): Number of vectors to copy at once. Defaults to 2**16.
+        overwrite (bool, optional): Overwrite existing index files in the directory. Defaults to False.
+
+    Raises:
+        ValueError: When the index files exist and `overwrite=False`.
+    """
+    index_dir.mkdir(parents=True, exist_ok=True)
+    names = ["vectors.npy", "doc_ids.npy", "psg_ids.npy"]
+    lookup_names = [
+        f"sorted_{ds}{suffix}.npy" for ds in ["doc_ids", "psg_ids"] for suffix in ["", "_offsets", "_rows"]
+    ]
+    if not overwrite and any((index_dir / name).exists() for name in names + lookup_names):
+        raise ValueError(f"Index files in {index_dir} exist.")
+
+    with h5py.File(index_file, "r") as fp:
+        num_vectors, _ = _committed_size(fp)
+        dtypes = [fp["vectors"].dtype]
+        for ds in ["doc_ids", "psg_ids"]:
+            if f"{ds}_offsets" in fp:
+                # the .npy files have fixed-width IDs, as wide as the longest one
+                max_length = int(np.diff(fp[f"{ds}_offsets"][: num_vectors + 1]).max(initial=1))
+                dtypes.append(np.dtype(f"S{max_length}"))
+            else:
+                # h5py attaches metadata to string dtypes that .npy files cannot store, so only the plain dtype is used
+                dtypes.append(np.dtype(fp[ds].dtype.str))
+        shapes = [(num_vectors, fp["vectors"].shape[1]), (num_vectors,), (num_vectors,)]
+        targets = [
+            np.lib.format.open_memmap(index_dir / name, mode="w+", dtype=dtype, shape=shape)
+            for name, dtype, shape in zip(names, dtypes, shapes)
+        ]
+        for i_low in tqdm(range(0, num_vectors, buffer_size)):
+            i_up = min(i_low + buffer_size, num_vectors)
+            targets[0][i_low:i_up] = fp["vectors"][i_low:i_up]
+            for target, ds in zip(targets[1:], ["doc_ids", "psg_ids"]):
+                target[i_low:i_up] = _read_ids(fp, ds, i_low, i_up)
+        for target in targets:
+            target.flush()
+
+    for i, ds in enumerate(["doc_ids", "psg_ids"]):
+        lookup = OnDiskIndex._build_lookup(np.asarray(targets[i + 1]))
+        for name, data in zip(lookup_names[3 * i: 3 * i + 3], lookup):
+            np.save(index_dir / name, data)
+
+
+class MemmapIndex(Index):
+    """Fast-Forward index that is memory-mapped from raw `.npy` files.
+
+    The vectors are a single contiguous array opened with `np.memmap`, so nothing is read before it is
+    needed and the pages are cached by the OS, shared between all processes that open the same index.
+    Create the files from an existing `OnDiskIndex` with `convert_hdf5`. The index is read-only.
+
+    The IDs are looked up in the sorted unique IDs and the offsets of their rows stored by `convert_hdf5`, which are
+    memory-mapped as well, so opening the index takes the same time for any number of vectors.
+    """
+
+    def __init__(
+            self,
+            index_dir: Path,
+            query_encoder: Encoder = None,
+            mode: Mode = Mode.PASSAGE,
+            encoder_batch_size: int = 32,
+    ) -> None:
+        """Open an index created by `convert_hdf5`.
+
+        Args:
+            index_dir (Path): Directory with the index files.
+            query_encoder (Encoder, optional): Query encoder. Defaults to None.
+            mode (Mode, optional): Ranking mode. Defaults to Mode.PASSAGE.
+            encoder_batch_size (int, optional): Batch size for query encoder. Defaults to 32.
+        """
+        super().__init__(query_encoder, mode, encoder_batch_size)
+        self._index_dir = index_dir.absolute()
+        self._vectors = np.load(self._index_dir / "vectors.npy", mmap_mode="r")
+
+        # the sorted unique IDs and, CSR-style, the offsets of their rows, like the lookup of `OnDiskIndex`
+        self._lookup = {
+            ds: tuple(
+                np.load(self._index_dir / f"sorted_{ds}{suffix}.npy", mmap_mode="r")
+                for suffix in ["", "_offsets", "_rows"]
+            )
+            for ds in ["doc_ids", "psg_ids"]
+        }
+
+    def __len__(self) -> int:
+        return self._vectors.shape[0]
+
+    @property
+    def dim(self) -> int:
+        return self._vectors.shape[1]
+
+    def _add(
+            self,
+            vectors: np.ndarray,
+            doc_ids: Union[Sequence[str], None],
+            psg_ids: Union[Sequence[str], None],
+    ) -> None:
+        raise RuntimeError("MemmapIndex is read-only, add the vectors to an OnDiskIndex and convert it.")
+
+    def _get_doc_ids(self) -> Set[str]:
+        return set(np.char.decode(self._lookup["doc_ids"][0], "utf-8").tolist())
+
+    def _get_psg_ids(self) -> Set[str]:
+        return set(np.char.decode(self._lookup["psg_ids"][0], "utf-8").tolist())
+
+    def _get_vectors(self, ids: Iterable[str]) -> Tuple[np.ndarray, List[List[int]]]:
+        ids = list(ids)
+        rows, id_offsets = _find_rows(
+            self._lookup["psg_ids" if self.mode == Mode.PASSAGE else "doc_ids"], ids, self.mode
+        )
+
+        # reading the rows in file order touches every page at most once
+        order = np.argsort(rows, kind="stable")
+        vectors = np.empty((len(rows), self.dim), dtype=self._vectors.dtype)
+        vectors[order] = self._vectors[rows[order]]
+        return vectors, [list(range(f, t)) for f, t in zip(id_offsets[:-1], id_offsets[1:])]
@@ -0,0 +1,371 @@
+import logging
+from pathlib import Path
+from typing import Dict, Iterable, List, Sequence, Tuple, Union
+
+import h5py
+import numpy as np
+from tqdm import tqdm
+
+from fast_forward.encoder import Encoder
+from fast_forward.index import Mode
+
+from util.disk import OnDiskIndex, _read_ids, _write_ids
+from util.sharded import _committed_size
+
+LOGGER = logging.getLogger(__name__)
+
+METHODS = ("float16", "int8", "pq")
+
+
+def train_scalar_codebook(sample: np.ndarray) -> Dict[str, np.ndarray]:
+    """Train an int8 scalar quantizer, which maps the range of every dimension to 256 levels.
+
+    Args:
+        sample (np.ndarray): Sample of the vectors.
+
+    Returns:
+        Dict[str, np.ndarray]: The "scale" and "offset" of every dimension, a code `c` stands for `c * scale + offset`.
+    """
+    low = sample.min(axis=0).astype(np.float32)
+    high = sample.max(axis=0).astype(np.float32)
+    scale = np.maximum(high - low, np.finfo(np.float32).tiny) / 255
+    return {"scale": scale, "offset": low + 128 * scale}
+
+
+def _nearest(x: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Return the nearest centroid of every vector.
+
+    Args:
+        x (np.ndarray): The vectors.
+        centroids (np.ndarray): The centroids.
+
+    Returns:
+        np.ndarray: The positions of the centroids.
+    """
+    # the norm of x does not change the order, so the squared distances are computed up to it
+    return np.argmin(np.sum(centroids ** 2, axis=1) - 2 * x @ centroids.T, axis=1)
+
+
+def train_pq_codebook(
+        sample: np.ndarray,
+        num_subvectors: int,
+        num_centroids: int = 256,
+        num_iterations: int = 20,
+        seed: int = 0,
+) -> Dict[str, np.ndarray]:
+    """Train a product quantizer: the vectors are split into subvectors and each of them is quantized with k-means.
+
+    Args:
+        sample (np.ndarray): Sample of the vectors.
+        num_subvectors (int): The number of subvectors, it has to divide the dimension.
+        num_centroids (int, optional): The number of centroids per subvector, at most 256. Defaults to 256.
+        num_iterations (int, optional): The number of k-means iterations. Defaults to 20.
+        seed (int, optional): Seed for the initial centroids. Defaults to 0.
+
+    Raises:
+        ValueError: When the number of subvectors does not divide the dimension or there are too many centroids.
+
+    Returns:
+        Dict[str, np.ndarray]: The "centroids", of shape `(num_subvectors, num_centroids, dim // num_subvectors)`.
+    """
+    num_vectors, dim = sample.shape
+    if dim % num_subvectors != 0:
+        raise ValueError(f"{num_subvectors} subvectors do not divide the dimension {dim}.")
+    if num_centroids > 256:
+        raise ValueError("The codes are bytes, there can be at most 256 centroids.")
+
+    rng = np.random.default_rng(seed)
+    subvectors = sample.astype(np.float32).reshape(num_vectors, num_subvectors, dim // num_subvectors)
+    centroids = np.empty((num_subvectors, num_centroids, dim // num_subvectors), dtype=np.float32)
+    for j in tqdm(range(num_subvectors), desc="training codebook"):
+        x = subvectors[:, j]
+        c = x[rng.choice(num_vectors, num_centroids, replace=num_vectors < num_centroids)]
+        for _ in range(num_iterations):
+            assignment = _nearest(x, c)
+            counts = np.bincount(assignment, minlength=num_centroids)
+            sums = np.stack(
+                [np.bincount(assignment, weights=x[:, t], minlength=num_centroids) for t in range(x.shape[1])],
+                axis=1,
+            )
+            # empty clusters are restarted at random vectors
+            empty = counts == 0
+            c[~empty] = sums[~empty] / counts[~empty, None]
+            c[empty] = x[rng.choice(num_vectors, empty.sum())]
+        centroids[j] = c
+    return {"centroids": centroids}
+
+
+class QuantizedIndex(OnDiskIndex):
+    """`OnDiskIndex` that stores compressed codes instead of float32 vectors, with the codebook in the index file.
+
+    The storage methods are "float16" (half precision, no codebook), "int8" (scalar quantization of every dimension,
+    `train_scalar_codebook`) and "pq" (product quantization, `train_pq_codebook`, one byte per subvector).
+    Added vectors are encoded with the codebook, existing indexes are converted with `quantize_index`.
+
+    `_get_vectors` returns the decoded vectors, so the index works anywhere a Fast-Forward index does.
+    `score_codes` computes scores on the codes directly, e.g. for `FFBatchScore`: "int8" codes are multiplied with
+    the scaled query vectors and "pq" codes look up the products of the query subvectors and the centroids in a table
+    per query. Loaded with `in_memory=True`, the codes are held in memory, `to_memory()` decodes all vectors instead.
+    """
+
+    def __init__(
+            self,
+            index_file: Path,
+            dim: int,
+            method: str,
+            codebook: Dict[str, np.ndarray] = None,
+            query_encoder: Encoder = None,
+            mode: Mode = Mode.PASSAGE,
+            encoder_batch_size: int = 32,
+            **kwargs,
+    ) -> None:
+        """Create an index.
+
+        Args:
+            index_file (Path): Index file to create (or overwrite).
+            dim (int): Vector dimensionality.
+            method (str): "float16", "int8" or "pq".
+            codebook (Dict[str, np.ndarray], optional): The trained codebook, None for "float16". Defaults to None.
+            query_encoder (Encoder, optional): Query encoder. Defaults to None.
+            mode (Mode, optional): Ranking mode. Defaults to Mode.PASSAGE.
+            encoder_batch_size (int, optional): Batch size for query encoder. Defaults to 32.
+            **kwargs: Additional arguments for `OnDiskIndex`, except `dtype`.
+
+        Raises:
+            ValueError: When the method is unknown or the codebook does not fit it.
+        """
+        if method not in METHODS:
+            raise ValueError(f"Unknown quantization method {method}.")
+        expected = {"float16": set(), "int8": {"scale", "offset"}, "pq": {"centroids"}}[method]
+        if set(codebook or {}) != expected:
+            raise ValueError(f"The codebook of {method} has to contain {sorted(expected)}.")
+
+        self._set_codebook(dim, method, codebook or {})
+        super().__init__(
+            index_file,
+            self._code_shape[0],
+            query_encoder=query_encoder,
+            mode=mode,
+            encoder_batch_size=encoder_batch_size,
+            dtype=self._code_shape[1],
+            **kwargs,
+        )
+        self._fp.attrs["quantization"] = method
+        self._fp.attrs["vector_dim"] = dim
+        for name, data in self._codebook.items():
+            self._fp.create_dataset(f"codebook_{name}", data=data)
+        self._fp.flush()
+
+    def _set_codebook(self, dim: int, method: str, codebook: Dict[str, np.ndarray]) -> None:
+        """Set the method and the codebook, and derive the width and dtype of the codes."""
+        self._vector_dim = dim
+        self._method = method
+        self._codebook = {name: np.asarray(data, dtype=np.float32) for name, data in codebook.items()}
+        self._codes = None
+        if method == "float16":
+            self._code_shape = (dim, np.float16)
+        elif method == "int8":
+            self._code_shape = (dim, np.int8)
+        else:
+            self._code_shape = (self._codebook["centroids"].shape[0], np.uint8)
+
+    @property
+    def dim(self) -> int:
+        return self._vector_dim
+
+    @property
+    def method(self) -> str:
+        return self._method
+
+    @property
+    def nbytes(self) -> int:
+        """Return the size of the codes and the codebook in bytes."""
+        return len(self) * self._code_shape[0] * np.dtype(self._code_shape[1]).itemsize + sum(
+            data.nbytes for data in self._codebook.values()
+        )
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        """Compress vectors into codes.
+
+        Args:
+            vectors (np.ndarray): The vectors.
+
+        Returns:
+            np.ndarray: The codes.
+        """
+        if self._method == "float16":
+            return vectors.astype(np.float16)
+        if self._method == "int8":
+            levels = np.rint((vectors - self._codebook["offset"]) / self._codebook["scale"])
+            return np.clip(levels, -128, 127).astype(np.int8)
+
+        centroids = self._codebook["centroids"]
+        subvectors = vectors.astype(np.float32).reshape(len(vectors), centroids.shape[0], centroids.shape[2])
+        codes = np.empty((len(vectors), centroids.shape[0]), dtype=np.uint8)
+        for j in range(centroids.shape[0]):
+            codes[:, j] = _nearest(subvectors[:, j], centroids[j])
+        return codes
+
+    def _decode(self, vectors: np.ndarray) -> np.ndarray:
+        if self._method == "float16":
+            return vectors.astype(np.float32)
+        if self._method == "int8":
+            return vectors * self._codebook["scale"] + self._codebook["offset"]
+
+        centroids = self._codebook["centroids"]
+        return centroids[np.arange(centroids.shape[0]), vectors].reshape(len(vectors), self._vector_dim)
+
+    def score_codes(self, q_vectors: np.ndarray, q_idxs: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """Compute the scores of query-vector pairs on the codes, without decoding them.
+
+        Args:
+            q_vectors (np.ndarray): The query vectors.
+            q_idxs (np.ndarray): The position of the query of every pair in `q_vectors`.
+            codes (np.ndarray): The code of every pair.
+
+        Returns:
+            np.ndarray: The scores.
+        """
+        if self._method == "float16":
+            return np.sum(q_vectors[q_idxs] * codes, axis=1)
+        if self._method == "int8":
+            # q . (c * scale + offset) = (q * scale) . c + q . offset
+            scaled = (q_vectors * self._codebook["scale"]).astype(np.float32)
+            return np.sum(scaled[q_idxs] * codes, axis=1) + (q_vectors @ self._codebook["offset"])[q_idxs]
+
+        # one table of the products of the query subvectors and the centroids per query
+        centroids = self._codebook["centroids"]
+        tables = np.einsum(
+            "bmd,mkd->bmk", q_vectors.reshape(len(q_vectors), centroids.shape[0], centroids.shape[2]), centroids
+        ).astype(np.float32)
+        return tables[q_idxs[:, None], np.arange(centroids.shape[0]), codes].sum(axis=1)
+
+    def _add(
+            self,
+            vectors: np.ndarray,
+            doc_ids: Union[Sequence[str], None],
+            psg_ids: Union[Sequence[str], None],
+    ) -> None:
+        # the codes held in memory are outdated
+        self._codes = None
+        super()._add(self.encode(vectors), doc_ids, psg_ids)
+
+    def _read_rows(self, rows: np.ndarray) -> np.ndarray:
+        if self._codes is None:
+            return super()._read_rows(rows)
+        return self._codes[rows]
+
+    def _get_codes_csr(self, ids: Iterable[str], warn: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+        """Like `_get_vectors_csr`, but the codes are returned instead of the vectors.
+
+        Args:
+            ids (Iterable[str]): The document or passage IDs.
+            warn (bool, optional): Log the IDs without vectors. Defaults to True.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The codes and the offsets of the codes of every ID.
+        """
+        return super()._get_vectors_csr(ids, warn)
+
+    def _get_vectors_csr(self, ids: Iterable[str], warn: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+        codes, offsets = self._get_codes_csr(ids, warn)
+        return self._decode(codes), offsets
+
+    def _get_vectors(self, ids: Iterable[str]) -> Tuple[np.ndarray, List[List[int]]]:
+        codes, id_to_idxs = super()._get_vectors(ids)
+        return self._decode(codes), id_to_idxs
+
+    @classmethod
+    def load(cls, index_file: Path, in_memory: bool = False, **kwargs) -> "QuantizedIndex":
+        """Open an existing quantized index on disk.
+
+        Args:
+            index_file (Path): Index file to open.
+            in_memory (bool, optional): Read all codes into memory. Defaults to False.
+            **kwargs: Additional arguments for `OnDiskIndex.load`.
+
+        Raises:
+            ValueError: When the index is not quantized.
+
+        Returns:
+            QuantizedIndex: The index.
+        """
+        index = super().load(index_file, **kwargs)
+        fp = index._file()
+        if "quantization" not in fp.attrs:
+            raise ValueError(f"{index_file} is not quantized, see `quantize_index`.")
+        index._set_codebook(
+            int(fp.attrs["vector_dim"]),
+            str(fp.attrs["quantization"]),
+            {ds[len("codebook_"):]: fp[ds][:] for ds in fp.keys() if ds.startswith("codebook_")},
+        )
+        if in_memory:
+            index._codes = fp["vectors"][: index._num_vectors]
+        return index
+
+
+def quantize_index(
+        index_file: Path,
+        quantized_file: Path,
+        method: str,
+        num_subvectors: int = 96,
+        num_centroids: int = 256,
+        sample_size: int = 2 ** 16,
+        num_iterations: int = 20,
+        buffer_size: int = 2 ** 16,
+        overwrite: bool = False,
+        seed: int = 0,
+) -> None:
+    """Convert an `OnDiskIndex` file into a `QuantizedIndex` file, training the codebook on a sample of the vectors.
+    The vectors are encoded in blocks aligned to the chunks of the new index, and the IDs are copied.
+
+    Args:
+        index_file (Path): The index file, e.g. "ffindex_fiqa_tct.h5".
+        quantized_file (Path): Index file to create.
+        method (str): "float16", "int8" or "pq".
+        num_subvectors (int, optional): Number of subvectors ("pq" only), i.e. bytes per vector. Defaults to 96.
+        num_centroids (int, optional): Number of centroids per subvector ("pq" only). Defaults to 256.
+        sample_size (int, optional): Number of vectors to train the codebook on. Defaults to 2**16.
+        num_iterations (int, optional): Number of k-means iterations ("pq" only). Defaults to 20.
+        buffer_size (int, optional): Number of vectors to encode at once. Defaults to 2**16.
+        overwrite (bool, optional): Overwrite the quantized file if it exists. Defaults to False.
+        seed (int, optional): Seed for the sample and the codebook. Defaults to 0.
+    """
+    source = OnDiskIndex.load(index_file)
+    with h5py.File(index_file, "r") as fp:
+        num_vectors, num_docs = _committed_size(fp)
+    rng = np.random.default_rng(seed)
+    sample = source._read_rows(np.sort(rng.choice(num_vectors, min(sample_size, num_vectors), replace=False)))
+    source.close()
+
+    if method == "int8":
+        codebook = train_scalar_codebook(sample)
+    elif method == "pq":
+        codebook = train_pq_codebook(sample, num_subvectors, num_centroids, num_iterations, seed)
+    else:
+        codebook = None
+    index = QuantizedIndex(
+        quantized_file, sample.shape[1], method, codebook, init_size=max(num_vectors, 1), overwrite=overwrite
+    )
+
+    out = index._file(writable=True)
+    # the blocks start at multiples of the chunk size of the new index, so every chunk is written once
+    block_size = max(buffer_size // out["vectors"].chunks[0], 1) * out["vectors"].chunks[0]
+    with h5py.File(index_file, "r") as fp:
+        for i_low in tqdm(range(0, num_vectors, block_size), desc="quantizing"):
+            i_up = min(i_low + block_size, num_vectors)
+            out["vectors"][i_low:i_up] = index.encode(fp["vectors"][i_low:i_up])
+            for name in ("doc_ids", "psg_ids"):
+                _write_ids(out, name, i_low, _read_ids(fp, name, i_low, i_up), 2.0)
+
+    out.attrs["num_vectors"] = num_vectors
+    index._num_vectors = num_vectors
+    if num_docs is not None:
+        index.commit(num_docs)
+    LOGGER.info(
+        "quantized %s vectors with %s, %.1fx smaller",
+        num_vectors,
+        method,
+        num_vectors * sample.shape[1] * 4 / index.nbytes,
+    )
+    index.close()
@@ -0,0 +1,99 @@
+from typing import Union
+
+import numpy as np
+import pandas as pd
+
+
+def segment_starts(qids: Union[pd.Series, np.ndarray]) -> Union[np.ndarray, None]:
+    """Return the start positions of the queries if every query forms a single contiguous segment of rows.
+    This is the case for the output of `~bm25 % num_candidates` and `FFScore`.
+
+    Args:
+        qids (Union[pd.Series, np.ndarray]): The query IDs of the rows.
+
+    Returns:
+        Union[np.ndarray, None]: The first row of each segment, or None if the rows are not grouped by query.
+    """
+    qids = np.asarray(qids)
+    if len(qids) == 0:
+        return np.zeros(0, dtype=np.int64)
+    starts = np.concatenate(([0], np.flatnonzero(qids[1:] != qids[:-1]) + 1))
+    # the rows are grouped iff no query starts more than one segment
+    if len(pd.unique(qids[starts])) != len(starts):
+        return None
+    return starts
+
+
+def _segmented_argsort(
+        keys: np.ndarray, starts: np.ndarray, sizes: np.ndarray, segments: np.ndarray, positions: np.ndarray
+) -> np.ndarray:
+    """Sort the keys within each contiguous segment in ascending order.
+
+    Args:
+        keys (np.ndarray): The keys to sort.
+        starts (np.ndarray): The first position of each segment.
+        sizes (np.ndarray): The size of each segment.
+        segments (np.ndarray): The segment of each position.
+        positions (np.ndarray): The position of each key within its segment.
+
+    Returns:
+        np.ndarray: The indices that sort the keys within each segment.
+    """
+    max_size = sizes.max()
+    if len(sizes) * max_size > 2 * len(keys):
+        # padding segments of very different sizes would waste too much memory
+        return np.lexsort((keys, segments))
+
+    # sorting small rows is much more cache friendly than a global sort, the padding is sorted last
+    padded = np.full((len(sizes), max_size), np.inf)
+    padded[segments, positions] = keys
+    local = np.argsort(padded, axis=1, kind="stable")
+    return (local + starts[:, None])[np.arange(max_size) < sizes[:, None]]
+
+
+def descending_rank(df: pd.DataFrame, column: str) -> np.ndarray:
+    """Rank the values of a column within each query in descending order, ties get their average rank.
+    The result equals `df.groupby("qid")[column].rank(ascending=False)`.
+
+    If the rows are grouped by query, the ranks are derived from the row positions, after a single segmented
+    argsort unless the values are already sorted in descending order within each query.
+    Unordered input falls back to `pd.DataFrame.groupby`.
+
+    Args:
+        df (pd.DataFrame): The PyTerrier data frame.
+        column (str): The column to rank.
+
+    Returns:
+        np.ndarray: The ranks (starting at 1), in the order of the data frame.
+    """
+    values = df[column].to_numpy(dtype=np.float64)
+    starts = segment_starts(df["qid"])
+    if starts is None or np.isnan(values).any():
+        return df.groupby("qid")[column].rank(ascending=False).to_numpy()
+
+    n = len(values)
+    if n == 0:
+        return values
+    sizes = np.diff(np.append(starts, n))
+    segments = np.repeat(np.arange(len(starts)), sizes)
+    positions = np.arange(n) - starts[segments]
+    same_segment = segments[1:] == segments[:-1]
+    if np.all((values[1:] <= values[:-1]) | ~same_segment):
+        order = None
+    else:
+        order = _segmented_argsort(-values, starts, sizes, segments, positions)
+        values = values[order]
+
+    # ties are adjacent now, each run of equal values gets the average of its positions
+    new_run = np.ones(n, dtype=bool)
+    new_run[1:] = (values[1:] != values[:-1]) | ~same_segment
+    run_starts = np.flatnonzero(new_run)
+    run_ends = np.append(run_starts[1:], n) - 1
+    run_ranks = (positions[run_starts] + positions[run_ends]) / 2 + 1
+    ranks = run_ranks[np.cumsum(new_run) - 1]
+
+    if order is None:
+        return ranks
+    result = np.empty(n, dtype=np.float64)
+    result[order] = ranks
+    return result
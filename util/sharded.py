@@ -0,0 +1,224 @@
+import itertools
+import logging
+from pathlib import Path
+from typing import Iterable, List, Sequence, Set, Tuple, TypeVar, Union
+
+import h5py
+import numpy as np
+from tqdm import tqdm
+
+from fast_forward.encoder import Encoder
+from fast_forward.index import Index, Mode
+
+from util.disk import OnDiskIndex, _read_ids, _write_ids
+
+LOGGER = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def shard_range(data: Iterable[T], shard: int, num_shards: int, num_docs: int) -> Iterable[T]:
+    """Return the documents of one of `num_shards` consecutive ranges of a collection, to index it in parallel
+    with one process per shard. The shards are merged with `merge_shards` or served by a `ShardedIndex`.
+
+    Args:
+        data (Iterable[T]): The collection, in the same order for every shard.
+        shard (int): The number of the shard, starting at 0.
+        num_shards (int): The number of shards.
+        num_docs (int): The number of documents in the collection.
+
+    Returns:
+        Iterable[T]: The documents of the shard.
+    """
+    shard_size = -(-num_docs // num_shards)
+    return itertools.islice(data, shard * shard_size, min((shard + 1) * shard_size, num_docs))
+
+
+def _committed_size(fp: h5py.File) -> Tuple[int, Union[int, None]]:
+    """Return the number of vectors of a shard file and the number of its documents, None if it was never committed.
+    Vectors added after the last commit are not part of the shard.
+    """
+    if "committed_num_vectors" in fp.attrs:
+        return int(fp.attrs["committed_num_vectors"]), int(fp.attrs["committed_num_docs"])
+    return int(fp.attrs["num_vectors"]), None
+
+
+def merge_shards(
+        shard_files: Sequence[Path],
+        index_file: Path,
+        buffer_size: int = 2 ** 16,
+        hdf5_chunk_size: int = None,
+        overwrite: bool = False,
+) -> None:
+    """Concatenate the `OnDiskIndex` files of the shards of a collection into a single index file.
+    The vectors and IDs are copied in blocks aligned to the chunks of the new index, and the ID lookup is built from
+    the concatenated IDs.
+
+    Args:
+        shard_files (Sequence[Path]): The shard files, in corpus order.
+        index_file (Path): Index file to create.
+        buffer_size (int, optional): Number of vectors to copy at once. Defaults to 2**16.
+        hdf5_chunk_size (int, optional): Override chunk size used by HDF5. Defaults to None.
+        overwrite (bool, optional): Overwrite index file if it exists. Defaults to False.
+
+    Raises:
+        ValueError: When the shards have different dimensions or dtypes.
+    """
+    shards = [h5py.File(shard_file, "r") for shard_file in shard_files]
+    try:
+        sizes = [_committed_size(fp) for fp in shards]
+        num_vectors = sum(n for n, _ in sizes)
+        if len({fp["vectors"].shape[1] for fp in shards}) > 1 or len({fp["vectors"].dtype for fp in shards}) > 1:
+            raise ValueError("The shards have different dimensions or dtypes.")
+
+        index = OnDiskIndex(
+            index_file,
+            shards[0]["vectors"].shape[1],
+            init_size=max(num_vectors, 1),
+            hdf5_chunk_size=hdf5_chunk_size,
+            dtype=shards[0]["vectors"].dtype,
+            overwrite=overwrite,
+        )
+        out = index._file(writable=True)
+        # the blocks start at multiples of the chunk size of the new index, so every chunk is written once
+        block_size = max(buffer_size // out["vectors"].chunks[0], 1) * out["vectors"].chunks[0]
+        buffer = np.empty((block_size, out["vectors"].shape[1]), dtype=out["vectors"].dtype)
+
+        offset = 0
+        with tqdm(total=num_vectors, unit="vectors") as progress:
+            for fp, (shard_num_vectors, _) in zip(shards, sizes):
+                i_low = 0
+                while i_low < shard_num_vectors:
+                    i_up = min(((offset + i_low) // block_size + 1) * block_size - offset, shard_num_vectors)
+                    fp["vectors"].read_direct(buffer, np.s_[i_low:i_up], np.s_[: i_up - i_low])
+                    out["vectors"].write_direct(buffer, np.s_[: i_up - i_low], np.s_[offset + i_low: offset + i_up])
+                    for name in ("doc_ids", "psg_ids"):
+                        _write_ids(out, name, offset + i_low, _read_ids(fp, name, i_low, i_up), 2.0)
+                    progress.update(i_up - i_low)
+                    i_low = i_up
+                offset += shard_num_vectors
+    finally:
+        for fp in shards:
+            fp.close()
+
+    out.attrs["num_vectors"] = num_vectors
+    index._num_vectors = num_vectors
+    if all(num_docs is not None for _, num_docs in sizes):
+        index.commit(sum(num_docs for _, num_docs in sizes))
+    index.close()
+
+
+class ShardedIndex(Index):
+    """Fast-Forward index that serves the `OnDiskIndex` files of the shards of a collection as a single index.
+
+    The shards are queried in corpus order. In MAXP and AVEP mode, the vectors of a document are collected from all
+    shards, in FIRSTP mode they are taken from the first shard that has the document and in PASSAGE mode from the
+    last one, like in a merged index. The index is read-only.
+    """
+
+    def __init__(
+            self,
+            shard_files: Sequence[Path],
+            query_encoder: Encoder = None,
+            mode: Mode = Mode.PASSAGE,
+            encoder_batch_size: int = 32,
+            **kwargs,
+    ) -> None:
+        """Open the shards of an index.
+
+        Args:
+            shard_files (Sequence[Path]): The shard files, in corpus order.
+            query_encoder (Encoder, optional): Query encoder. Defaults to None.
+            mode (Mode, optional): Ranking mode. Defaults to Mode.PASSAGE.
+            encoder_batch_size (int, optional): Batch size for query encoder. Defaults to 32.
+            **kwargs: Additional arguments for `OnDiskIndex.load`.
+
+        Raises:
+            ValueError: When the shards have different dimensions.
+        """
+        self._shards = [OnDiskIndex.load(shard_file, mode=mode, **kwargs) for shard_file in shard_files]
+        if len({shard.dim for shard in self._shards}) > 1:
+            raise ValueError("The shards have different dimensions.")
+        super().__init__(query_encoder, mode, encoder_batch_size)
+
+    @property
+    def mode(self) -> Mode:
+        return self._mode
+
+    @mode.setter
+    def mode(self, mode: Mode) -> None:
+        for shard in self._shards:
+            shard.mode = mode
+        self._mode = mode
+
+    def close(self) -> None:
+        """Close the files of all shards."""
+        for shard in self._shards:
+            shard.close()
+
+    def __enter__(self) -> "ShardedIndex":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return sum(len(shard) for shard in self._shards)
+
+    @property
+    def dim(self) -> int:
+        return self._shards[0].dim
+
+    def _add(
+            self,
+            vectors: np.ndarray,
+            doc_ids: Union[Sequence[str], None],
+            psg_ids: Union[Sequence[str], None],
+    ) -> None:
+        raise RuntimeError("ShardedIndex is read-only, add the vectors to one of the shards.")
+
+    def _get_doc_ids(self) -> Set[str]:
+        return set().union(*(shard.doc_ids for shard in self._shards))
+
+    def _get_psg_ids(self) -> Set[str]:
+        return set().union(*(shard.psg_ids for shard in self._shards))
+
+    def _get_vectors_csr(self, ids: Iterable[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """Like `_get_vectors`, but the vectors are grouped by ID, CSR-style, instead of mapped by lists.
+        Every shard looks up the IDs in its sorted ID lookup, the vectors are then grouped by ID in shard order.
+
+        Args:
+            ids (Iterable[str]): The document or passage IDs.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The vectors and the offsets of the vectors of every ID.
+        """
+        ids = np.asarray(list(ids), dtype=object)
+        shards = self._shards[::-1] if self.mode == Mode.PASSAGE else self._shards
+        remaining = np.arange(len(ids))
+        vectors, positions = [], []
+        for shard in shards:
+            if len(remaining) == 0:
+                break
+            shard_vectors, offsets = shard._get_vectors_csr(ids[remaining].tolist(), warn=False)
+            counts = np.diff(offsets)
+            vectors.append(shard_vectors)
+            positions.append(np.repeat(remaining, counts))
+            # only MAXP and AVEP need the vectors of a document from more than one shard
+            if self.mode not in (Mode.MAXP, Mode.AVEP):
+                remaining = remaining[counts == 0]
+
+        positions = np.concatenate(positions) if len(positions) > 0 else np.zeros(0, dtype=np.int64)
+        counts = np.bincount(positions, minlength=len(ids))
+        for id in ids[counts == 0]:
+            LOGGER.warning("no vectors for %s", id)
+        id_offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+        np.cumsum(counts, out=id_offsets[1:])
+        if len(vectors) == 0:
+            return np.zeros((0, self.dim), dtype=np.float32), id_offsets
+        # a stable sort keeps the shard order within every ID
+        return np.concatenate(vectors)[np.argsort(positions, kind="stable")], id_offsets
+
+    def _get_vectors(self, ids: Iterable[str]) -> Tuple[np.ndarray, List[List[int]]]:
+        vectors, id_offsets = self._get_vectors_csr(ids)
+        return vectors, [list(range(f, t)) for f, t in zip(id_offsets[:-1], id_offsets[1:])]
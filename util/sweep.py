@@ -0,0 +1,75 @@
+from typing import List, Sequence
+
+import numpy as np
+import pyterrier as pt
+from fast_forward.util.pyterrier import FFInterpolate
+
+from util.CondorcetFuseInterpolate import CondorcetFuseInterpolate
+from util.FFMinMaxInterpolate import FFMinMaxInterpolate
+from util.FFZScoreInterpolate import FFZScoreInterpolate
+from util.Evaluator import Evaluator
+from util.MultiFusion import FusionStatistics
+from util.ReciprocalInterpolate import ReciprocalInterpolate
+
+
+def sweep(ff_int: pt.Transformer, stats: FusionStatistics, grid: Sequence) -> np.ndarray:
+    """Compute the scores of an interpolation transformer for every value of its `alpha` parameter at once.
+    Column `j` equals the "score" column the transformer returns with `alpha=grid[j]`, in the order of the input frame.
+
+    Args:
+        ff_int (pt.Transformer): The interpolation transformer.
+        stats (FusionStatistics): The statistics of the input frame.
+        grid (Sequence): The values of `alpha`, pairs `[k_lex, k_dense]` for `ReciprocalInterpolate`.
+
+    Raises:
+        ValueError: When the transformer does not have an `alpha` parameter.
+
+    Returns:
+        np.ndarray: The scores, shape `(num_rows, len(grid))`.
+    """
+    if isinstance(ff_int, ReciprocalInterpolate):
+        k = np.asarray(grid, dtype=np.float64)
+        return (1 / (k[None, :, 0] + stats.l_rank[:, None])) + (1 / (k[None, :, 1] + stats.s_rank[:, None]))
+
+    alpha = np.asarray(grid, dtype=np.float64)[None, :]
+    if isinstance(ff_int, FFMinMaxInterpolate) or isinstance(ff_int, CondorcetFuseInterpolate):
+        l_min, l_max, s_min, s_max = stats.min_max
+        lexical = ((stats.score_0 - l_min) / (l_max - l_min))[:, None]
+        semantic = ((stats.score - s_min) / (s_max - s_min))[:, None]
+    elif isinstance(ff_int, FFZScoreInterpolate):
+        l_mean, l_std, s_mean, s_std = stats.mean_std
+        lexical = ((stats.score_0 - l_mean) / l_std)[:, None]
+        semantic = ((stats.score - s_mean) / s_std)[:, None]
+    elif isinstance(ff_int, FFInterpolate):
+        lexical = stats.score_0[:, None]
+        semantic = stats.score[:, None]
+    else:
+        raise ValueError(f"Cannot sweep {ff_int}, it has no alpha parameter.")
+
+    scores = alpha * lexical + (1 - alpha) * semantic
+    if isinstance(ff_int, CondorcetFuseInterpolate):
+        scores = stats.wins[:, None] + np.nan_to_num(scores, nan=0.0, posinf=np.inf, neginf=-np.inf)
+    return scores
+
+
+def grid_search(evaluator: Evaluator, scores: np.ndarray, grid: Sequence, metrics: Sequence[str]) -> List:
+    """Find the grid value with the best evaluation result for each metric, like `pt.GridSearch` over a score matrix.
+    Every column is evaluated once for all metrics. On ties, the first grid value wins.
+
+    Args:
+        evaluator (Evaluator): The evaluator for the frame the scores were computed for.
+        scores (np.ndarray): The scores, shape `(num_rows, len(grid))`.
+        grid (Sequence): The parameter value of each column.
+        metrics (Sequence[str]): The metrics to maximize.
+
+    Returns:
+        List: The best parameter value for each metric.
+    """
+    results = evaluator.evaluate(scores, metrics)
+    best_settings = []
+    for metric in metrics:
+        best = int(np.argmax(results[str(metric)]))
+        print("Best %s is %f" % (metric, results[str(metric)][best]))
+        print("Best setting is alpha=%s" % str(grid[best]))
+        best_settings.append(grid[best])
+    return best_settings